@@ -0,0 +1,82 @@
+import os
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy
+
+
+# Caches of geometry that is worked out once and reused for any plane, like
+# project_to_sphere.SphereLUT and project_to_torus.TorusMap.  The most
+# recently used are kept in memory and, if a directory is given, saved there
+# as .npy files for later runs.  A cached class names its numpy array
+# attributes in _ARRAYS (one may be None, and then isn't saved), and can be
+# made from them as keyword arguments.
+
+
+class ArrayCache(object):
+    """ Up to size objects of a class, by key, most recently used last.  Keys
+        start with name and version, so that files saved before the objects
+        (or how they're stored) changed aren't loaded; bump the version with
+        any such change. """
+
+    def __init__(self, cls: type, name: str, version: int, size: int):
+        self.cls = cls
+        self.name = name
+        self.version = version
+        self.size = size
+        self.cached: OrderedDict = OrderedDict()
+
+    def key(self, *parts: str) -> str:
+        """ Names an object, in memory and on disk, from the parts that
+            identify it. """
+        return "_".join((f"{self.name}_v{self.version}",) + parts)
+
+    def get(self, key: str, compute: Callable[[], object],
+            directory: Optional[str] = None) -> object:
+        """ The object for key, from memory, else from directory (if given),
+            else computed (and saved to directory). """
+        if key in self.cached:
+            self.cached.move_to_end(key)
+            return self.cached[key]
+
+        thing = None if directory is None else self.load(directory, key)
+        if thing is None:
+            thing = compute()
+            if directory is not None:
+                self.save(thing, directory, key)
+
+        self.cached[key] = thing
+        while len(self.cached) > self.size:
+            self.cached.popitem(last=False)
+        return thing
+
+    def clear(self) -> None:
+        self.cached.clear()
+
+    def save(self, thing, directory: str, key: str) -> None:
+        """ Write thing's arrays as <key>_<name>.npy files in directory.  Each
+            file is written under a temporary name first, and the first array
+            goes last, so a half-written object is never loaded. """
+        os.makedirs(directory, exist_ok=True)
+        for name in reversed(self.cls._ARRAYS):
+            array = getattr(thing, name)
+            if array is None:
+                continue
+            path = os.path.join(directory, f"{key}_{name}.npy")
+            with open(path + ".tmp", "wb") as f:
+                numpy.save(f, array)
+            os.replace(path + ".tmp", path)
+
+    def load(self, directory: str, key: str) -> Optional[object]:
+        """ Read an object written by save, memory-mapped, or None if there
+            isn't one.  Arrays missing after the first were None. """
+        arrays = {}
+        for i, name in enumerate(self.cls._ARRAYS):
+            path = os.path.join(directory, f"{key}_{name}.npy")
+            if not os.path.exists(path):
+                if i == 0:
+                    return None
+                arrays[name] = None
+                continue
+            arrays[name] = numpy.load(path, mmap_mode='r')
+        return self.cls(**arrays)
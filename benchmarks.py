@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+
+import numpy
+import pygame
+
+import hextiles
+import project_to_sphere
+import project_to_torus
+import rainbow_tile
+import sampler
+
+
+# Timings for the renderers.  Run as
+#   $ python benchmarks.py [<benchmark name> ...]
+# with no names to run them all.
+
+
+def noise_plane(size=(4000, 4000), seed=0) -> pygame.Surface:
+    """ A plane of random opaque colours, so there's nothing to compress or
+        cache. """
+    rng = numpy.random.default_rng(seed)
+    plane = pygame.Surface(size, pygame.SRCALPHA)
+    pygame.surfarray.pixels3d(plane)[:] = rng.integers(0, 256, (*size, 3),
+                                                       dtype=numpy.uint8)
+    pygame.surfarray.pixels_alpha(plane)[:] = 255
+    return plane
+
+
+def timed(f, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    f(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def sphere_workers(radius=2500, max_workers=None):
+    """ project_image_to_sphere throughput against the number of worker
+        processes.  Each run computes the geometry from scratch. """
+    max_workers = max_workers or os.cpu_count()
+    plane = noise_plane()
+
+    project_to_sphere._lut_cache.clear()
+    single = timed(project_to_sphere.project_image_to_sphere,
+                   None, plane, radius)
+    project_to_sphere._lut_cache.clear()
+    print(f"\rsphere radius {radius}, {os.cpu_count()} cores")
+    print(f"  workers  seconds  speedup")
+    print(f"  {1:7d}  {single:7.2f}  {1:7.2f}")
+
+    workers = 2
+    while workers <= max_workers:
+        seconds = timed(project_to_sphere.project_image_to_sphere,
+                        None, plane, radius, workers=workers)
+        print(f"\r  {workers:7d}  {seconds:7.2f}  {single / seconds:7.2f}")
+        workers *= 2
+
+
+def torus_workers(size=1200, max_workers=None):
+    """ project_image_to_torus throughput against the number of worker
+        processes, for the engines that can use them. """
+    max_workers = max_workers or os.cpu_count()
+    plane = noise_plane((4750, 2500))
+
+    print(f"\rtorus size {size}, {os.cpu_count()} cores")
+    for engine in ('raycast', 'splat'):
+        single = timed(project_to_torus.project_image_to_torus,
+                       (size, size), plane, engine=engine)
+        print(f"\r  {engine}")
+        print(f"  workers  seconds  speedup")
+        print(f"  {1:7d}  {single:7.2f}  {1:7.2f}")
+
+        workers = 2
+        while workers <= max_workers:
+            seconds = timed(project_to_torus.project_image_to_torus,
+                            (size, size), plane, engine=engine,
+                            workers=workers)
+            print(f"\r  {workers:7d}  {seconds:7.2f}  {single / seconds:7.2f}")
+            workers *= 2
+
+
+def hextiles_atlas(canvas_size=(6400, 6400), tile_scale=0.25):
+    """ create_random_hexagonal_tiled_surface with and without the
+        orientation atlas, for the pink_plane of nested_spheres.pink_sphere.
+        The planes are checked to be the same. """
+    tile = rainbow_tile.pink_tile()
+    planes = []
+    print(f"\rpink plane {canvas_size[0]}x{canvas_size[1]}, "
+          f"tile scale {tile_scale}")
+    print(f"  atlas  seconds")
+    for use_atlas in (False, True):
+        start = time.perf_counter()
+        plane = hextiles.create_random_hexagonal_tiled_surface(
+            tile, canvas_size, tile_scale, pygame.Color(0, 0, 0, 0),
+            use_atlas=use_atlas, seed=0)
+        seconds = time.perf_counter() - start
+        planes.append(pygame.image.tobytes(plane, "RGBA"))
+        print(f"\r  {str(use_atlas):>5}  {seconds:7.2f}")
+    assert planes[0] == planes[1]
+
+
+def hextiles_workers(canvas_size=(6400, 6400), tile_scale=0.25,
+                     max_workers=None):
+    """ create_random_hexagonal_tiled_surface throughput against the number
+        of worker processes, for the pink_plane.  The planes are checked to
+        be the same. """
+    max_workers = max_workers or os.cpu_count()
+    tile = rainbow_tile.pink_tile()
+
+    def plane(workers):
+        return pygame.image.tobytes(
+            hextiles.create_random_hexagonal_tiled_surface(
+                tile, canvas_size, tile_scale, pygame.Color(0, 0, 0, 0),
+                seed=0, workers=workers), "RGBA")
+
+    start = time.perf_counter()
+    single_plane = plane(1)
+    single = time.perf_counter() - start
+    print(f"\rpink plane {canvas_size[0]}x{canvas_size[1]}, "
+          f"{os.cpu_count()} cores")
+    print(f"  workers  seconds  speedup")
+    print(f"  {1:7d}  {single:7.2f}  {1:7.2f}")
+
+    workers = 2
+    while workers <= max_workers:
+        start = time.perf_counter()
+        assert plane(workers) == single_plane
+        seconds = time.perf_counter() - start
+        print(f"\r  {workers:7d}  {seconds:7.2f}  {single / seconds:7.2f}")
+        workers *= 2
+
+
+def hextiles_pyramid(canvas_size=(6400, 6400), tile_scale=0.25):
+    """ The pink_plane and its whole mip pyramid, with the levels shrunk from
+        the plane (as trilinear filtering would build them) and with the top
+        ones drawn by create_random_hexagonal_tiled_surface(...,
+        pyramid=True).  Also how long sampler.use_pyramid takes to install
+        the drawn levels on their own. """
+    tile = rainbow_tile.pink_tile()
+    background = pygame.Color(0, 0, 0, 0)
+    print(f"\rpink plane {canvas_size[0]}x{canvas_size[1]}, "
+          f"tile scale {tile_scale}")
+    print(f"  levels  seconds")
+    for pyramid in (False, True):
+        start = time.perf_counter()
+        plane = hextiles.create_random_hexagonal_tiled_surface(
+            tile, canvas_size, tile_scale, background, seed=0,
+            pyramid=pyramid)
+        sampler.sampler_for(plane).build_pyramid()
+        seconds = time.perf_counter() - start
+        print(f"\r  {'drawn' if pyramid else 'shrunk':>6}  {seconds:7.2f}")
+
+    levels = hextiles._pyramid_levels([tile], canvas_size, tile_scale,
+                                      background, False, True,
+                                      hextiles.seed_key(0), None)
+    start = time.perf_counter()
+    sampler.use_pyramid(plane, levels)
+    seconds = time.perf_counter() - start
+    print(f"\r  use_pyramid of {len(levels)} levels  {seconds:7.2f}")
+
+
+BENCHMARKS = {
+    'sphere_workers': sphere_workers,
+    'torus_workers': torus_workers,
+    'hextiles_atlas': hextiles_atlas,
+    'hextiles_workers': hextiles_workers,
+    'hextiles_pyramid': hextiles_pyramid,
+}
+
+if __name__ == "__main__":
+    def main():
+        names = sys.argv[1:] or list(BENCHMARKS)
+        for name in names:
+            BENCHMARKS[name]()
+
+
+    main()
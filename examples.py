@@ -6,9 +6,28 @@ import show_canvas
 import hextiles
 
 
-def pastel_torus(size: int = 1200):
+def _torus(plane: pygame.Surface, size: int, preview: bool,
+           engine: str) -> pygame.Surface:
+    # with preview, show the torus getting sharper as it renders
+    if preview:
+        return show_canvas.show_progress(
+            project_to_torus.progressive_torus((size, size), plane),
+            (600, 600))
+    # the python engine samples the torus densely, so it's smooth but slow.
+    # 'map' takes seconds, with one sample per pixel, and keeps where the rays
+    # hit in torus_maps/ for other planes of the same size.
+    if engine == 'map':
+        return project_to_torus.project_image_to_torus(
+            (size, size), plane, engine='map', map_directory="torus_maps")
+    return project_to_torus.project_image_to_torus((size, size), plane,
+                                                   engine=engine)
+
+
+def pastel_torus(size: int = 1200, preview: bool = False,
+                 engine: str = 'python'):
     # makes a torus out of solid pastel hexagons
-    # 1200 takes ~5 minutes, use 400 for a quick look
+    # 1200 takes ~5 minutes (seconds with engine='map', but rougher), use 400
+    # for a quick look
     height = 250
     tiles = []
     for i in range(6):
@@ -40,14 +59,16 @@ def pastel_torus(size: int = 1200):
     # show_canvas.show_canvas(plane)
     pygame.image.save(plane, f"pastel_plane.png")
 
-    torus = project_to_torus.project_image_to_torus((size, size), plane)
+    torus = _torus(plane, size, preview, engine)
     pygame.image.save(torus, f"pastel_torus_{size}.jpg")
 
 
 def ribbon_torus(size: int = 1200,
-                 colour: pygame.Color = pygame.Color(255, 0, 255, 255)):
+                 colour: pygame.Color = pygame.Color(255, 0, 255, 255),
+                 preview: bool = False, engine: str = 'python'):
     # makes a torus out of hexagonal tiles with pink ribbon
-    # 1200 takes ~5 minutes, use 400 for a quick look
+    # 1200 takes ~5 minutes (seconds with engine='map', but rougher), use 400
+    # for a quick look
     height = 250
     tile = rainbow_tile.pink_tile(height=height+1, extent=0.5)
     plane = hextiles.create_random_hexagonal_tiled_surface(
@@ -60,13 +81,15 @@ def ribbon_torus(size: int = 1200,
 
     pygame.image.save(plane, f"ribbon_plane.png")
 
-    torus = project_to_torus.project_image_to_torus((size, size), plane)
+    torus = _torus(plane, size, preview, engine)
     pygame.image.save(torus, f"ribbon_torus_{size}.jpg")
 
 def bagel_torus(size: int = 1200,
-                bg_colour: pygame.Color = pygame.Color(179,155,133,255)):
+                bg_colour: pygame.Color = pygame.Color(179,155,133,255),
+                preview: bool = False, engine: str = 'python'):
     # makes a torus out of hexagonal tiles with pink ribbon
-    # 1200 takes ~5 minutes, use 400 for a quick look
+    # 1200 takes ~5 minutes (seconds with engine='map', but rougher), use 400
+    # for a quick look
     tile = pygame.image.load("bagel_tile_250.png")
     height = tile.get_height() - 1
     plane = hextiles.create_random_hexagonal_tiled_surface(
@@ -79,12 +102,13 @@ def bagel_torus(size: int = 1200,
 
     pygame.image.save(plane, f"bagel_plane.png")
 
-    torus = project_to_torus.project_image_to_torus((size, size), plane)
+    torus = _torus(plane, size, preview, engine)
     pygame.image.save(torus, f"bagel_torus_{size}.jpg")
 
 
 # Example Renders.  Simply uncomment the ones you want to render.
 # The 'fast' version in each case gives a much rougher view, for testing.
+# Or pass preview=True to a torus to watch it render coarse to fine.
 
 # fast = True
 fast = False
@@ -106,3 +130,5 @@ nested_spheres.pink_sphere()
 # pastel_torus(400 if fast else 1200)
 # ribbon_torus(400 if fast else 1200)
 # bagel_torus(200 if fast else 1200)
+# ribbon_torus(1200, preview=True)
+# ribbon_torus(1200, engine='map')
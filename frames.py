@@ -0,0 +1,54 @@
+import subprocess
+import sys
+from typing import Iterable, List, Tuple
+
+import pygame
+
+
+# Writing a sequence of frames (e.g. from nested_spheres.nest_frames) as they
+# are made, so only one frame is held in memory at a time.
+
+
+def save_frames(frames: Iterable[pygame.Surface],
+                pattern: str = "frame_{:04d}.png") -> int:
+    """ Saves each frame to a numbered file, pattern.format(frame number).
+        Returns the number of frames. """
+    count = 0
+    for count, frame in enumerate(frames, 1):
+        pygame.image.save(frame, pattern.format(count - 1))
+        sys.stdout.write(f"\rFrames saved: {count}")
+        sys.stdout.flush()
+    sys.stdout.write("\r")
+    sys.stdout.flush()
+    return count
+
+
+def ffmpeg_command(size: Tuple[int, int], output: str,
+                   fps: float = 30) -> List[str]:
+    """ A command line for ffmpeg that reads raw RGB frames of the given size
+        on stdin and encodes them to output. """
+    return ["ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+            "-pix_fmt", "yuv420p", output]
+
+
+def pipe_frames(frames: Iterable[pygame.Surface], command: List[str]) -> int:
+    """ Writes each frame as raw RGB bytes to the standard input of command,
+        for instance one made by ffmpeg_command.  Returns the number of frames.
+    """
+    count = 0
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for count, frame in enumerate(frames, 1):
+            process.stdin.write(pygame.image.tobytes(frame, "RGB"))
+            sys.stdout.write(f"\rFrames piped: {count}")
+            sys.stdout.flush()
+    finally:
+        process.stdin.close()
+        returncode = process.wait()
+    sys.stdout.write("\r")
+    sys.stdout.flush()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return count
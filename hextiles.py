@@ -1,5 +1,10 @@
+import functools
+import hashlib
 import math
-from typing import Optional
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
 import pygame
 import random
@@ -8,7 +13,9 @@ import sys
 
 from pygame.math import clamp
 
+import png_stream
 import rainbow_tile
+import sampler
 
 
 # Take a hexagonal tile and repeat it over the plane, with random orientation.
@@ -65,11 +72,264 @@ def draw_centered_text(surface, text, font_path, font_size, color, x, y):
     surface.blit(rendered_text, text_rect)
 
 
+# Each tile is placed in one of 12 orientations, coded as a rotation in
+# range(-6, 6): r sixths of a turn, reflected first if r is negative.
+def orient_tile(tile: pygame.Surface, rotation: int) -> pygame.Surface:
+    if rotation < 0:
+        rotation = -rotation
+        tile = pygame.transform.flip(tile, True, False)
+    return pygame.transform.rotate(tile, rotation * 360 / 6)
+
+
+# All 12 orientations of a tile, indexed by rotation + 6, so that placing a
+# tile is just a blit.
+def orientation_atlas(tile: pygame.Surface) -> List[pygame.Surface]:
+    return [orient_tile(tile, rotation) for rotation in range(-6, 6)]
+
+
+def _mix(z: numpy.ndarray) -> numpy.ndarray:
+    """ The splitmix64 finaliser: scrambles the bits of uint64s. """
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return z ^ (z >> numpy.uint64(31))
+
+
+def tile_hash(key: int, row: numpy.ndarray, col: numpy.ndarray
+              ) -> numpy.ndarray:
+    """ 64 random-looking bits for each tile position, which only depend on
+        (key, row, col).  So any part of a plane can be made on its own, in
+        any order, and come out the same. """
+    with numpy.errstate(over='ignore'):
+        h = _mix(numpy.full(numpy.shape(row), key, dtype=numpy.uint64))
+        h = _mix(h ^ numpy.asarray(row).astype(numpy.uint64))
+        return _mix(h ^ numpy.asarray(col).astype(numpy.uint64))
+
+
+def seed_key(seed=None) -> int:
+    """ A 64 bit key for tile_hash from seed: an int (used as it is), a
+        numpy.random.Generator (which a key is drawn from) or None (for a
+        fresh random key). """
+    if seed is None:
+        return numpy.random.SeedSequence().entropy & (2 ** 64 - 1)
+    if isinstance(seed, numpy.random.Generator):
+        return int(seed.integers(2 ** 63))
+    return int(seed) & (2 ** 64 - 1)
+
+
+class HexLayout(object):
+    """ Which tile goes where, and which way round, on a hexagonal plane.
+        Tile centres are at (col * 3/2 * radius, row * height / 2) for the
+        (row, col) with row + col even, radius being height / sqrt(3).  The
+        arrays have one entry per tile, in the order they are drawn (row by
+        row), so later tiles overlap earlier ones.
+        A toroidal layout has a period, (columns, rows) that span the canvas
+        exactly, with the spacing of the tiles stretched or squeezed a little
+        to fit (see fundamental_period).  Its rows and columns carry on past
+        the edges, to draw the tiles that wrap around them.
+    """
+
+    def __init__(self, canvas_size: Tuple[int, int], tile_height: float,
+                 row: numpy.ndarray, col: numpy.ndarray,
+                 tile: numpy.ndarray, rotation: numpy.ndarray,
+                 period: Optional[Tuple[int, int]] = None):
+        self.canvas_size = canvas_size
+        self.tile_height = tile_height
+        self.row = row
+        self.col = col
+        self.tile = tile  # index into the list of tiles
+        self.rotation = rotation  # in range(-6, 6), see orient_tile
+        self.period = period
+
+    @property
+    def x(self) -> numpy.ndarray:
+        return HexLayout.centre_x(self.col, self.canvas_size[0],
+                                  self.tile_height, self.period)
+
+    @property
+    def y(self) -> numpy.ndarray:
+        return HexLayout.centre_y(self.row, self.canvas_size[1],
+                                  self.tile_height, self.period)
+
+    @staticmethod
+    def centre_x(col: numpy.ndarray, canvas_width: int, tile_height: float,
+                 period: Optional[Tuple[int, int]] = None) -> numpy.ndarray:
+        if period is None:
+            return col * (tile_height / math.sqrt(3)) * 3 / 2
+        # whole periods are added on separately, so a tile and its copies in
+        # other periods are exactly canvas_width apart
+        return ((col % period[0]) * canvas_width / period[0] +
+                (col // period[0]) * canvas_width)
+
+    @staticmethod
+    def centre_y(row: numpy.ndarray, canvas_height: int, tile_height: float,
+                 period: Optional[Tuple[int, int]] = None) -> numpy.ndarray:
+        if period is None:
+            return row * tile_height / 2
+        return ((row % period[1]) * canvas_height / period[1] +
+                (row // period[1]) * canvas_height)
+
+    @staticmethod
+    def grid(canvas_size: Tuple[int, int], tile_height: float
+             ) -> Tuple[int, int]:
+        """ (columns, rows) of tile positions needed to cover the canvas. """
+        tile_radius = tile_height / math.sqrt(3)
+        return (1 + math.ceil(canvas_size[0] * 2 / (3 * tile_radius)),
+                1 + math.ceil(canvas_size[1] * 2 / tile_height))
+
+    def select(self, which: numpy.ndarray) -> 'HexLayout':
+        """ The layout of just some of the tiles (a mask or indices). """
+        return HexLayout(self.canvas_size, self.tile_height, self.row[which],
+                         self.col[which], self.tile[which],
+                         self.rotation[which], self.period)
+
+    @staticmethod
+    def fundamental_period(canvas_size: Tuple[int, int], tile_height: float
+                           ) -> Tuple[int, int]:
+        """ (columns, rows) of tile positions after which a toroidal layout
+            of the canvas repeats: the even numbers of each that come nearest
+            to fitting it (even, so the rows of alternate columns line up
+            across the edges). """
+        tile_radius = tile_height / math.sqrt(3)
+        return (max(2, 2 * round(canvas_size[0] / (3 * tile_radius))),
+                max(2, 2 * round(canvas_size[1] / tile_height)))
+
+    @staticmethod
+    def choose(key: int, row: numpy.ndarray, col: numpy.ndarray,
+               num_tiles: int, period: Optional[Tuple[int, int]] = None,
+               allow_reflections: bool = True
+               ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ (tile, rotation) at each (row, col), from tile_hash.  With a
+            period (see fundamental_period) the positions repeat. """
+        if period is not None:
+            row = row % period[1]
+            col = col % period[0]
+        h = tile_hash(key, row, col)
+        tile = (h >> numpy.uint64(32)) % numpy.uint64(num_tiles)
+        # we'll use a negative rotation to code a reflection
+        low = h & numpy.uint64(0xFFFFFFFF)
+        if allow_reflections:
+            rotation = (low % numpy.uint64(12)).astype(numpy.int64) - 6
+        else:
+            rotation = (low % numpy.uint64(6)).astype(numpy.int64)
+        return tile.astype(numpy.int64), rotation
+
+    @staticmethod
+    def random(canvas_size: Tuple[int, int], tile_height: float,
+               num_tiles: int, toroidal: bool = False, seed=None,
+               allow_reflections: bool = True) -> 'HexLayout':
+        """ A random choice of tile (of num_tiles) and orientation for each
+            position, from tile_hash of seed_key(seed) and the position.  If
+            toroidal, it's one fundamental_period of the tiling that fits the
+            canvas, and the tiles on each edge are the ones that wrap around
+            from the other. """
+        if toroidal:
+            period = HexLayout.fundamental_period(canvas_size, tile_height)
+            # two more rows and columns each side, which is as far as a tile
+            # (or any turn of it) can reach
+            rows = numpy.arange(-2, period[1] + 3)
+            cols = numpy.arange(-2, period[0] + 3)
+        else:
+            period = None
+            num_tiles_x, num_tiles_y = HexLayout.grid(canvas_size, tile_height)
+            rows = numpy.arange(num_tiles_y)
+            cols = numpy.arange(num_tiles_x)
+
+        # the positions, row by row
+        placed = (rows[:, numpy.newaxis] + cols) % 2 == 0
+        row, col = numpy.nonzero(placed)
+        row, col = rows[row], cols[col]
+
+        tile, rotation = HexLayout.choose(seed_key(seed), row, col, num_tiles,
+                                          period, allow_reflections)
+        return HexLayout(canvas_size, tile_height, row, col, tile, rotation,
+                         period)
+
+
+# callable tiles kept by create_random_hexagonal_tiled_surface when
+# tile_levels is given.  Tiles are placed row by row, so this only needs to
+# hold a row's worth of buckets for each callable tile.
+TILE_CACHE_SIZE = 64
+
+
+def _bucket(fraction: float, levels: int) -> float:
+    """ The centre of the one of levels equal buckets of [0, 1] that
+        fraction falls in. """
+    return (min(int(fraction * levels), levels - 1) + 0.5) / levels
+
+
+def _layout_blits(layout: HexLayout, scaled_tiles: list,
+                  atlases: List[Optional[List[pygame.Surface]]],
+                  tile_scale: float, tile_levels: Optional[int] = None,
+                  origin: Tuple[int, int] = (0, 0), progress: bool = True
+                  ) -> Iterator[Tuple[pygame.Surface, Tuple[int, int]]]:
+    """ (image, position) for each tile of the layout, for Surface.blits on
+        a surface whose top left corner is at origin on the canvas.
+        Callable tiles are made (and turned) as they are reached, so only one
+        is held at a time.  With tile_levels, each of x and y is rounded to
+        the middle of one of tile_levels buckets, and the last TILE_CACHE_SIZE
+        tiles made are kept for reuse. """
+    canvas_width, canvas_height = layout.canvas_size
+    periodic = layout.period is not None
+    first_row = layout.row[0] if len(layout.row) else 0
+    num_rows = layout.row[-1] - first_row + 1 if len(layout.row) else 0
+    last_row = None
+    made: 'OrderedDict[tuple, pygame.Surface]' = OrderedDict()
+    for row, x, y, chosen_tile, chosen_rotation in zip(
+            layout.row.tolist(), layout.x.tolist(), layout.y.tolist(),
+            layout.tile.tolist(), layout.rotation.tolist()):
+        if progress and row != last_row:
+            percent = (row - first_row + 1) / num_rows * 100
+            sys.stdout.write(f"\rRandom-plane Progress: {percent:.0f}%")
+            sys.stdout.flush()
+            last_row = row
+
+        if atlases[chosen_tile] is not None:
+            rotated_image = atlases[chosen_tile][chosen_rotation + 6]
+        else:
+            scaled_tile = scaled_tiles[chosen_tile]
+            if callable(scaled_tile):
+                # a tile wrapped around an edge is made where it came from
+                fx = clamp((x % canvas_width if periodic else x) /
+                           canvas_width, 0, 1)
+                fy = clamp((y % canvas_height if periodic else y) /
+                           canvas_height, 0, 1)
+                if tile_levels is None:
+                    scaled_tile = pygame.transform.smoothscale_by(
+                        scaled_tile(fx, fy), tile_scale)
+                else:
+                    key = (chosen_tile, _bucket(fx, tile_levels),
+                           _bucket(fy, tile_levels))
+                    if key in made:
+                        made.move_to_end(key)
+                    else:
+                        made[key] = pygame.transform.smoothscale_by(
+                            scaled_tile(*key[1:]), tile_scale)
+                        if len(made) > TILE_CACHE_SIZE:
+                            made.popitem(last=False)
+                    scaled_tile = made[key]
+            rotated_image = orient_tile(scaled_tile, chosen_rotation)
+
+        # adjust to ensure center alignment.  round() takes halves to even,
+        # so a tile and its copy a period away could round differently.
+        if periodic:
+            left = math.floor(x - rotated_image.get_width() / 2 + 0.5)
+            top = math.floor(y - rotated_image.get_height() / 2 + 0.5)
+        else:
+            left = round(x - rotated_image.get_width() / 2)
+            top = round(y - rotated_image.get_height() / 2)
+        yield rotated_image, (left - origin[0], top - origin[1])
+
+
 def create_random_hexagonal_tiled_surface(
         tile_paths, canvas_size=(6400, 6400), tile_scale=1.0,
         background_colour: Optional[pygame.Color]
         = pygame.Color(255, 255, 255, 255),
-        toroidal = False
+        toroidal = False,
+        use_atlas = True,
+        seed = None,
+        tile_levels: Optional[int] = None,
+        workers: int = 1,
+        pyramid: bool = False
 ) -> pygame.Surface:
     """
     Generates a hexagonal tiled surface using a provided image or callable tile
@@ -90,29 +350,105 @@ def create_random_hexagonal_tiled_surface(
         background_colour (Optional[pygame.Color]): 
             The background color to fill the canvas, defaults to white 
             (pygame.Color(255, 255, 255, 255)).
-        toroidal (bool): False by default.  If true, the tiles on the left/right
-            and top/bottom edges will be the same.  It's up to the caller to
-            make sure that the repeats match an integral number of tiles.  To do
-            this, set the size to (height*m, height*n) where m is odd and n is
-            even.
+        toroidal (bool): False by default.  If true, the canvas is one period
+            of a tiling that repeats seamlessly left to right and top to
+            bottom, and tiles across an edge carry on at the other, so it can
+            wrap a torus.  Any size will do: the spacing of the tiles is
+            stretched or squeezed a little to fit a whole number of them (see
+            HexLayout.fundamental_period).
+        use_atlas (bool): True by default, when every orientation of each
+            (non-callable) tile is made once up front, rather than rotating
+            each tile as it is placed.  The result is the same.
+        seed (Union[None, int, numpy.random.Generator]): where the random
+            choices come from (see HexLayout.random).  The same seed gives the
+            same plane, however it's drawn.
+        tile_levels (Optional[int]): None by default, when a callable tile is
+            called for every position.  Otherwise x and y are each rounded to
+            the middle of one of tile_levels equal steps, and the tiles made
+            are reused, so a plane costs at most tile_levels**2 calls per
+            callable tile.  More levels are closer to the exact positions.
+        workers (int): 1 by default.  If more, the canvas is drawn in strips by
+            that many processes (see _draw_in_strips), which gives the same
+            plane.
+        pyramid (bool): False by default.  If true, the top levels of the
+            plane's mip pyramid, which trilinear filtering samples, are drawn
+            too (see _pyramid_levels), rather than shrunk from the plane.
 
     Returns:
         pygame.Surface: 
             A pygame surface containing the hexagonal tiled pattern.
     """
-    # Create canvas
-    canvas = pygame.Surface(canvas_size, flags=pygame.SRCALPHA)
-
-    # Canvas fill will be the colour we see through any transparency in the tile
-    if background_colour is not None:
-        canvas.fill(background_colour)
-    # canvas.fill((255, 0, 255))  # Fill with pink
-    # canvas.fill((179, 179, 179))  # Fill with grey 30% (0xB3)
-    # canvas.fill((255,255,255))  # Fill with white
-
     if not isinstance(tile_paths, list):
         tile_paths = [tile_paths]
+    key = seed_key(seed)
+
+    if workers > 1:
+        canvas = _draw_in_strips(tile_paths, canvas_size, tile_scale,
+                                 background_colour, toroidal, use_atlas, key,
+                                 tile_levels, workers)
+    else:
+        scaled_tiles, atlases, tile_height, reach = _prepare_tiles(
+            tile_paths, tile_scale, use_atlas)
+        layout = HexLayout.random(canvas_size, tile_height, len(scaled_tiles),
+                                  toroidal, key)
+        canvas = _draw_region(layout, scaled_tiles, atlases, tile_scale,
+                              tile_levels, background_colour,
+                              (0, 0, *canvas_size), reach)
+    if pyramid:
+        sampler.use_pyramid(canvas, _pyramid_levels(
+            tile_paths, canvas_size, tile_scale, background_colour, toroidal,
+            use_atlas, key, tile_levels))
+
+    sys.stdout.write(f"\rRandom-plane Done.")  # Overwrite the progress line
+    sys.stdout.flush()
+    return canvas
+
+
+# _pyramid_levels draws levels until the tiles would be smaller than this.
+# Below that, the pixel by which neighbouring tiles overlap is too much of a
+# tile, and the levels are shrunk from the last one drawn.
+PYRAMID_MIN_TILE_HEIGHT = 16
+
 
+def _pyramid_levels(tile_paths: list, canvas_size: Tuple[int, int],
+                    tile_scale: float,
+                    background_colour: Optional[pygame.Color], toroidal: bool,
+                    use_atlas: bool, key: int, tile_levels: Optional[int]
+                    ) -> List[pygame.Surface]:
+    """ The levels of the plane's mip pyramid below the plane itself, at the
+        sizes sampler.level_sizes gives, for sampler.use_pyramid.  Each is the
+        plane's layout drawn again at its scale, with the tiles scaled from
+        the originals to match, so that a tile is filtered once, from its
+        full size, rather than once a level. """
+    _, _, tile_height, _ = _prepare_tiles(tile_paths, tile_scale, False)
+    layout = HexLayout.random(canvas_size, tile_height, len(tile_paths),
+                              toroidal, key)
+    levels = []
+    sizes = [canvas_size]
+    while tile_height / 2 ** len(sizes) >= PYRAMID_MIN_TILE_HEIGHT:
+        sizes = sampler.level_sizes(canvas_size, len(sizes) + 1)
+        level_height = tile_height / 2 ** (len(sizes) - 1)
+        # the tiles are a pixel taller than the rows are apart, as at the top
+        # (see _prepare_tiles)
+        scale = tile_scale * (level_height + 1) / (tile_height + 1)
+        scaled_tiles, atlases, _, reach = _prepare_tiles(tile_paths, scale,
+                                                         use_atlas)
+        level_layout = HexLayout(sizes[-1], level_height, layout.row,
+                                 layout.col, layout.tile, layout.rotation,
+                                 layout.period)
+        levels.append(_draw_region(level_layout, scaled_tiles, atlases, scale,
+                                   tile_levels, background_colour,
+                                   (0, 0, *sizes[-1]), reach, progress=False))
+    return levels
+
+
+def _prepare_tiles(tile_paths: list, tile_scale: float, use_atlas: bool
+                   ) -> Tuple[list, List[Optional[List[pygame.Surface]]],
+                              int, int]:
+    """ For create_random_hexagonal_tiled_surface: the scaled tiles (or
+        callables), their orientation atlases (None for callables), the
+        spacing of the rows of tiles, and how far from its centre any
+        orientation of a tile can reach. """
     # Load image(s) if files
     full_tiles = [
         pygame.image.load(tp) if isinstance(tp, str) else tp
@@ -132,10 +468,7 @@ def create_random_hexagonal_tiled_surface(
     # but it is a hack.  ideally this would be factored in to the tile design
     # which would have some bleed.
     tile_height = scaled_tile0.get_height() - 1
-    tile_radius = tile_height / math.sqrt(3)
-    tile_diameter = tile_height * 2 / math.sqrt(3)
-    num_tiles_x = 1 + math.ceil(canvas_size[0] * 2 / (3 * tile_radius))
-    num_tiles_y = 1 + math.ceil(canvas_size[1] * 2 / tile_height)
+    reach = math.ceil(math.hypot(*scaled_tile0.get_size()) / 2) + 1
 
     # Build a list of either scaled tiles (so we only have to scale them once)
     # or else just the callable
@@ -147,85 +480,645 @@ def create_random_hexagonal_tiled_surface(
             scaled_tiles.append(
                 pygame.transform.smoothscale_by(full_tile, tile_scale))
 
-    # an array to hold the decisions on tile selection and rotation (negative
-    # for reflections)
-    selections = numpy.zeros((num_tiles_y, num_tiles_x * 2), dtype=numpy.int32)
-    selections[:] = numpy.iinfo(numpy.int32).min
-    rotations = numpy.zeros((num_tiles_y, num_tiles_x * 2), dtype=numpy.int32)
-    rotations[:] = numpy.iinfo(numpy.int32).min
+    # and for each scaled tile, all of its orientations
+    atlases = [orientation_atlas(scaled_tile)
+               if use_atlas and not callable(scaled_tile) else None
+               for scaled_tile in scaled_tiles]
+    return scaled_tiles, atlases, tile_height, reach
 
-    # we'll use a negative rotation to code a reflection
-    allow_reflections = True
 
-    # Place random copies with random rotations
-    for row in range(num_tiles_y):
+def _draw_region(layout: HexLayout, scaled_tiles: list,
+                 atlases: List[Optional[List[pygame.Surface]]],
+                 tile_scale: float, tile_levels: Optional[int],
+                 background_colour: Optional[pygame.Color],
+                 region: Tuple[int, int, int, int], reach: int,
+                 progress: bool = True) -> pygame.Surface:
+    """ The region (x0, y0, width, height) of the canvas, drawn with the
+        tiles of the layout that reach into it. """
+    x0, y0, width, height = region
+    surface = pygame.Surface((width, height), flags=pygame.SRCALPHA)
+
+    # Canvas fill will be the colour we see through any transparency in the tile
+    if background_colour is not None:
+        surface.fill(background_colour)
+    # canvas.fill((255, 0, 255))  # Fill with pink
+    # canvas.fill((179, 179, 179))  # Fill with grey 30% (0xB3)
+    # canvas.fill((255,255,255))  # Fill with white
 
-        progress = (row + 1) / num_tiles_y * 100  # Calculate progress percentage
-        sys.stdout.write(
-            f"\rRandom-plane Progress: {progress:.0f}%")  # Overwrite the progress line
-        sys.stdout.flush()  # Ensure the progress line gets updated immediately
+    x, y = layout.x, layout.y
+    near = layout.select((x + reach > x0) & (x - reach < x0 + width) &
+                         (y + reach > y0) & (y - reach < y0 + height))
+    surface.blits(_layout_blits(near, scaled_tiles, atlases, tile_scale,
+                                tile_levels, (x0, y0), progress),
+                  doreturn=False)
+    return surface
 
-        even_row = row % 2
-        for col in range(even_row, num_tiles_x, 2):
-            x = col * tile_radius * 3 / 2
-            y = row * tile_height / 2
 
-            if toroidal:
-                last_col = (col == num_tiles_x - 1)
-                last_row = (row == num_tiles_y - 1)
-                if last_col and last_row:
-                    chosen_tile = selections[0, 0]
-                    chosen_rotation = rotations[0, 0]
-                elif last_col:
-                    chosen_tile = selections[row, 0]
-                    chosen_rotation = rotations[row, 0]
-                elif last_row:
-                    chosen_tile = selections[0, col]
-                    chosen_rotation = rotations[0, col]
-                else:
-                    chosen_tile = random.randint(0, len(scaled_tiles) - 1)
-                    chosen_rotation = random.choice(range(-6, 6))
+def render_region(tile_paths, region: Tuple[int, int, int, int],
+                  canvas_size=(6400, 6400), tile_scale=1.0,
+                  background_colour: Optional[pygame.Color]
+                  = pygame.Color(255, 255, 255, 255),
+                  toroidal=False, use_atlas=True, seed=None,
+                  tile_levels: Optional[int] = None) -> pygame.Surface:
+    """ Just the region (x0, y0, width, height) of the plane that
+        create_random_hexagonal_tiled_surface makes with the same arguments,
+        pixel for pixel, drawing only the tiles that reach into it.  Pass the
+        same seed (a fresh random one won't match anything). """
+    if not isinstance(tile_paths, list):
+        tile_paths = [tile_paths]
+    scaled_tiles, atlases, tile_height, reach = _prepare_tiles(
+        tile_paths, tile_scale, use_atlas)
+    layout = HexLayout.random(canvas_size, tile_height, len(scaled_tiles),
+                              toroidal, seed)
+    return _draw_region(layout, scaled_tiles, atlases, tile_scale,
+                        tile_levels, background_colour, region, reach,
+                        progress=False)
+
+
+def _portable_tile(tile):
+    """ A tile as something that can be sent to a worker process: surfaces
+        go as their bytes, file names and callables as they are. """
+    if isinstance(tile, pygame.Surface):
+        return 'surface', pygame.image.tobytes(tile, "RGBA"), tile.get_size()
+    return tile
+
+
+def _unportable_tile(tile):
+    if isinstance(tile, tuple) and tile[0] == 'surface':
+        return pygame.image.frombytes(tile[1], tile[2], "RGBA")
+    return tile
+
+
+def _strip_worker(tiles: list, canvas_size: Tuple[int, int],
+                  tile_scale: float, background_colour, toroidal: bool,
+                  use_atlas: bool, key: int, tile_levels: Optional[int],
+                  top: int, bottom: int) -> bytes:
+    """ Worker for _draw_in_strips: rows top to bottom of the plane, as RGBA
+        bytes.  The layout is made again here; it's the same everywhere,
+        since it's a hash of the key and the tile positions. """
+    scaled_tiles, atlases, tile_height, reach = _prepare_tiles(
+        [_unportable_tile(tile) for tile in tiles], tile_scale, use_atlas)
+    layout = HexLayout.random(canvas_size, tile_height, len(scaled_tiles),
+                              toroidal, key)
+    strip = _draw_region(layout, scaled_tiles, atlases, tile_scale,
+                         tile_levels, background_colour,
+                         (0, top, canvas_size[0], bottom - top), reach,
+                         progress=False)
+    return pygame.image.tobytes(strip, "RGBA")
+
+
+def _plane_strips(tile_paths: list, canvas_size: Tuple[int, int],
+                  tile_scale: float, background_colour, toroidal: bool,
+                  use_atlas: bool, key: int, tile_levels: Optional[int],
+                  edges: List[int], workers: int) -> Iterator[bytes]:
+    """ The plane create_random_hexagonal_tiled_surface makes, as the RGBA
+        bytes of each strip of rows between successive edges, top to bottom.
+        Tiles straddling the edge of a strip are drawn in both, so the strips
+        stack up to the plane drawn whole.  With workers > 1 they're drawn by
+        a pool of worker processes, a couple of strips ahead of the one
+        wanted, so only a few are held at a time.  Callable tiles must then
+        be picklable (e.g. module level functions or functools.partial of
+        them). """
+    strips = list(zip(edges[:-1], edges[1:]))
+    if workers <= 1:
+        scaled_tiles, atlases, tile_height, reach = _prepare_tiles(
+            tile_paths, tile_scale, use_atlas)
+        layout = HexLayout.random(canvas_size, tile_height, len(scaled_tiles),
+                                  toroidal, key)
+        for top, bottom in strips:
+            yield pygame.image.tobytes(
+                _draw_region(layout, scaled_tiles, atlases, tile_scale,
+                             tile_levels, background_colour,
+                             (0, top, canvas_size[0], bottom - top), reach,
+                             progress=False), "RGBA")
+        return
+
+    tiles = [_portable_tile(tile) for tile in tile_paths]
+    if background_colour is not None:
+        background_colour = tuple(background_colour)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for top, bottom in strips:
+            pending.append(pool.submit(
+                _strip_worker, tiles, canvas_size, tile_scale,
+                background_colour, toroidal, use_atlas, key, tile_levels,
+                top, bottom))
+            if len(pending) > 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _draw_in_strips(tile_paths: list, canvas_size: Tuple[int, int],
+                    tile_scale: float, background_colour, toroidal: bool,
+                    use_atlas: bool, key: int, tile_levels: Optional[int],
+                    workers: int) -> pygame.Surface:
+    """ create_random_hexagonal_tiled_surface in horizontal strips, drawn by
+        a pool of worker processes and stacked (see _plane_strips). """
+    edges = numpy.linspace(0, canvas_size[1],
+                           workers * sampler.CHUNKS_PER_WORKER + 1)
+    edges = sorted({round(e) for e in edges})
+
+    strips = []
+    for bottom, strip in zip(edges[1:], _plane_strips(
+            tile_paths, canvas_size, tile_scale, background_colour, toroidal,
+            use_atlas, key, tile_levels, edges, workers)):
+        strips.append(strip)
+        progress = bottom / canvas_size[1] * 100
+        sys.stdout.write(f"\rRandom-plane Progress: {progress:.0f}%")
+        sys.stdout.flush()
+
+    return pygame.image.frombytes(b"".join(strips), canvas_size, "RGBA")
+
+
+# rows drawn at a time by save_hexagonal_tiled_plane
+STREAM_STRIP_HEIGHT = 512
+
+
+def save_hexagonal_tiled_plane(
+        path: str, tile_paths, canvas_size=(6400, 6400), tile_scale=1.0,
+        background_colour: Optional[pygame.Color]
+        = pygame.Color(255, 255, 255, 255),
+        toroidal=False, use_atlas=True, seed=None,
+        tile_levels: Optional[int] = None, workers: int = 1,
+        strip_height: int = STREAM_STRIP_HEIGHT) -> None:
+    """ Writes the plane create_random_hexagonal_tiled_surface makes with the
+        same arguments to path, strip_height rows at a time, so that it's
+        never all in memory: for planes too big for a Surface (a 32000 pixel
+        square one would be 4 GB).  The memory used goes with strip_height
+        (times a few, with workers) rather than the size of the plane.
+        If path ends in .png it's written as a PNG (see png_stream.py).
+        Otherwise it's raw RGBA bytes, row by row from the top, as
+        pygame.image.tobytes gives them, which
+          numpy.memmap(path, numpy.uint8, 'r', shape=(height, width, 4))
+        opens without reading it all in.  Either way it's written to path +
+        ".tmp" first, so an interrupted run doesn't leave half a plane.
+    """
+    if not isinstance(tile_paths, list):
+        tile_paths = [tile_paths]
+    key = seed_key(seed)
+    width, height = canvas_size
+    edges = list(range(0, height, strip_height)) + [height]
+
+    with open(path + ".tmp", "wb") as f:
+        png = path.lower().endswith(".png")
+        if png:
+            writer = png_stream.PNGWriter(f, canvas_size)
+        for bottom, strip in zip(edges[1:], _plane_strips(
+                tile_paths, canvas_size, tile_scale, background_colour,
+                toroidal, use_atlas, key, tile_levels, edges, workers)):
+            if png:
+                writer.write_rows(strip)
             else:
-                chosen_tile = random.randint(0, len(scaled_tiles) - 1)
-                chosen_rotation = random.choice(range(-6, 6))
+                f.write(strip)
+            progress = bottom / height * 100
+            sys.stdout.write(f"\rRandom-plane Progress: {progress:.0f}%")
+            sys.stdout.flush()
+        if png:
+            writer.close()
+    os.replace(path + ".tmp", path)
 
-            selections[row, col] = chosen_tile
-            scaled_tile = scaled_tiles[chosen_tile]
-            rotations[row, col] = chosen_rotation
+    sys.stdout.write(f"\rRandom-plane Done.")  # Overwrite the progress line
+    sys.stdout.flush()
 
-            if callable(scaled_tile):
-                full_tile = scaled_tile(
-                    clamp(x / canvas_size[0], 0, 1),
-                    clamp(y / canvas_size[1], 0, 1))
-                scaled_tile = pygame.transform.smoothscale_by(full_tile,
-                                                              tile_scale)
 
-            if chosen_rotation < 0:
-                chosen_rotation = -chosen_rotation
-                scaled_tile = pygame.transform.flip(scaled_tile, True, False)
+# points sampled at a time by ProceduralHexPlane, to keep the temporary
+# arrays small
+SAMPLE_CHUNK = 1 << 18
 
-            angle = chosen_rotation * 360 / 6
-            rotated_image = pygame.transform.rotate(scaled_tile, angle)
 
-            # Blit to canvas (adjust to ensure center alignment)
-            canvas.blit(rotated_image,
-                        (round(x - rotated_image.get_width() / 2),
-                         round(y - rotated_image.get_height() / 2)))
+class ProceduralHexPlane(object):
+    """ The plane create_random_hexagonal_tiled_surface draws, made only
+        where it's sampled, so it never has to be held in memory.  It takes
+        the same arguments, and samples as a sampler.PlaneSampler does, so the
+        sphere and torus projectors take it in place of a Surface.
+        Each sample is made from the (up to) four tiles whose images could
+        cover it, oriented as the layout says and composited in the order
+        they'd be drawn, so with 'nearest' filtering it's the drawn plane to
+        within rounding.  Only the tile positions the drawn plane has are
+        used, and it's sampled modulo its size, as a Surface is.  Filtered
+        samples use each tile's own mip pyramid, which is close to, but not
+        the same as, the drawn plane's.
+        Callable tiles need tile_levels, so that there are only so many of
+        them to make (the last TILE_CACHE_SIZE are kept).
+        Given a layout (as load_hexplane does), the tiles are placed as it
+        says rather than chosen from the seed.
+    """
+
+    def __init__(self, tile_paths, canvas_size=(6400, 6400), tile_scale=1.0,
+                 background_colour: Optional[pygame.Color]
+                 = pygame.Color(255, 255, 255, 255),
+                 toroidal=False, seed=None,
+                 tile_levels: Optional[int] = None,
+                 layout: Optional[HexLayout] = None):
+        if not isinstance(tile_paths, list):
+            tile_paths = [tile_paths]
+        self.canvas_size = tuple(canvas_size)
+        self.tile_scale = tile_scale
+        self.background_colour = None if background_colour is None \
+            else tuple(pygame.Color(background_colour))
+        self.toroidal = toroidal
+        self.key = seed_key(seed)
+        self.tile_levels = tile_levels
+        # what's pickled to send the plane to worker processes
+        self._portable = [_portable_tile(tile) for tile in tile_paths]
+
+        self._tiles, self._atlases, self.tile_height, self._reach = \
+            _prepare_tiles(tile_paths, tile_scale, True)
+        self._layout = layout
+        self._stored = layout is not None
+        if self._stored:
+            # the index of the layout's tile at each (row, col), or -1
+            self._first = (int(layout.row.min()), int(layout.col.min()))
+            self._entry = numpy.full(
+                (int(layout.row.max()) - self._first[0] + 1,
+                 int(layout.col.max()) - self._first[1] + 1), -1)
+            self._entry[layout.row - self._first[0],
+                        layout.col - self._first[1]] = \
+                numpy.arange(len(layout.row))
+        if tile_levels is None and any(callable(t) for t in self._tiles):
+            raise ValueError("A procedural plane of callable tiles needs "
+                             "tile_levels")
+        self.period = HexLayout.fundamental_period(
+            self.canvas_size, self.tile_height) if toroidal else None
+        # for each (tile, x bucket, y bucket), a sampler for each orientation
+        self._oriented: 'OrderedDict[tuple, list]' = OrderedDict()
+        for i, atlas in enumerate(self._atlases):
+            if atlas is not None:
+                self._oriented[i, 0, 0] = [_padded_sampler(image)
+                                           for image in atlas]
+
+    def __getstate__(self):
+        return dict(tile_paths=self._portable, canvas_size=self.canvas_size,
+                    tile_scale=self.tile_scale,
+                    background_colour=self.background_colour,
+                    toroidal=self.toroidal, seed=self.key,
+                    tile_levels=self.tile_levels,
+                    layout=self._layout if self._stored else None)
+
+    def __setstate__(self, state):
+        state['tile_paths'] = [_unportable_tile(tile)
+                               for tile in state['tile_paths']]
+        self.__init__(**state)
+
+    def get_size(self) -> Tuple[int, int]:
+        return self.canvas_size
 
-            # draw_centered_text(canvas, f"r{row},c{col}",
-            #                    pygame.font.get_default_font(), 48, (0, 0, 0),
-            #                    x, y)
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.canvas_size
 
+    @property
+    def opaque(self) -> bool:
+        return (self.background_colour is not None and
+                self.background_colour[3] == 255)
+
+    def fingerprint(self) -> bytes:
+        """ Identifies the plane: the same fingerprint, the same plane.  A
+            plane with a stored layout is identified by the layout, not the
+            (unused) seed, so each load of a .hexplane file matches. """
+        digest = hashlib.sha1(repr((self.canvas_size, self.tile_scale,
+                                    self.background_colour, self.toroidal,
+                                    None if self._stored else self.key,
+                                    self.tile_levels)).encode())
+        for tile in self._tiles:
+            if callable(tile):
+                tile = tile(0.5, 0.5)
+            digest.update(pygame.image.tobytes(tile, "RGBA"))
+        if self._stored:
+            for array in (self._layout.row, self._layout.col,
+                          self._layout.tile, self._layout.rotation):
+                digest.update(numpy.ascontiguousarray(array, numpy.int64))
+        return digest.digest()
+
+    def build_pyramid(self) -> None:
+        for samplers in self._oriented.values():
+            for tile_sampler in samplers:
+                tile_sampler.build_pyramid()
+
+    def get_at(self, position: Tuple[int, int]) -> pygame.Color:
+        colour, alpha = self.sample([position[0]], [position[1]], 'nearest')
+        return pygame.Color(*numpy.round(colour[0]).astype(int).tolist(),
+                            int(round(alpha[0])))
+
+    def region(self, x0: int, y0: int, width: int, height: int
+               ) -> pygame.Surface:
+        """ The region of the canvas, drawn as render_region draws it (so
+            exactly as the whole plane would be).  The layout of the canvas
+            is made the first time, and kept. """
+        if self._layout is None:
+            self._layout = HexLayout.random(self.canvas_size, self.tile_height,
+                                            len(self._tiles), self.toroidal,
+                                            self.key)
+        return _draw_region(self._layout, self._tiles, self._atlases,
+                            self.tile_scale, self.tile_levels,
+                            self.background_colour, (x0, y0, width, height),
+                            self._reach, progress=False)
+
+    def _samplers(self, tile: int, bx: int, by: int) -> list:
+        """ The orientations of a tile, made (and kept) if it's callable. """
+        key = (tile, bx, by)
+        if key in self._oriented:
+            self._oriented.move_to_end(key)
+        else:
+            made = pygame.transform.smoothscale_by(
+                self._tiles[tile]((bx + 0.5) / self.tile_levels,
+                                  (by + 0.5) / self.tile_levels),
+                self.tile_scale)
+            self._oriented[key] = [_padded_sampler(image)
+                                   for image in orientation_atlas(made)]
+            callables = [k for k in self._oriented
+                         if callable(self._tiles[k[0]])]
+            if len(callables) > TILE_CACHE_SIZE:
+                del self._oriented[callables[0]]
+        return self._oriented[key]
+
+    def _choose(self, row: numpy.ndarray, col: numpy.ndarray
+                ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ (tile, rotation) at each (row, col), as HexLayout.choose, or from
+            the layout given, with a tile of -1 where the drawn plane has
+            none. """
+        if not self._stored:
+            tile, rotation = HexLayout.choose(self.key, row, col,
+                                              len(self._tiles), self.period)
+            if self.period is None:
+                # only the positions HexLayout.random draws on the canvas
+                columns, rows = HexLayout.grid(self.canvas_size,
+                                               self.tile_height)
+                tile[(row < 0) | (row >= rows) | (col < 0) |
+                     (col >= columns)] = -1
+            return tile, rotation
+        i = row - self._first[0]
+        j = col - self._first[1]
+        inside = ((i >= 0) & (i < self._entry.shape[0]) &
+                  (j >= 0) & (j < self._entry.shape[1]))
+        entry = numpy.full(len(row), -1)
+        entry[inside] = self._entry[i[inside], j[inside]]
+        tile = numpy.where(entry >= 0, self._layout.tile[entry], -1)
+        rotation = numpy.where(entry >= 0, self._layout.rotation[entry], 0)
+        return tile.astype(numpy.int64), rotation.astype(numpy.int64)
+
+    def _tile_sample(self, row: numpy.ndarray, col: numpy.ndarray,
+                     u: numpy.ndarray, v: numpy.ndarray, filtering: str,
+                     footprint: Optional[numpy.ndarray]
+                     ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ (n, 3) colours and (n,) alphas in [0, 1] of the tile at each
+            (row, col), as it's drawn, at (u, v). """
+        tile, rotation = self._choose(row, col)
+        width, height = self.canvas_size
+        x = HexLayout.centre_x(col, width, self.tile_height, self.period)
+        y = HexLayout.centre_y(row, height, self.tile_height, self.period)
+        # the bucket of a callable tile, as in _layout_blits
+        if self.tile_levels is None:
+            bx = by = numpy.zeros_like(tile)
+        else:
+            levels = self.tile_levels
+            fx = x / width if self.period is None else x % width / width
+            fy = y / height if self.period is None else y % height / height
+            bx = numpy.minimum((numpy.clip(fx, 0, 1) * levels
+                                ).astype(numpy.int64), levels - 1)
+            by = numpy.minimum((numpy.clip(fy, 0, 1) * levels
+                                ).astype(numpy.int64), levels - 1)
+            fixed = numpy.array([not callable(t) for t in self._tiles])[tile]
+            bx[fixed] = 0
+            by[fixed] = 0
+
+        colour = numpy.zeros((len(u), 3))
+        alpha = numpy.zeros(len(u))
+        group = ((tile * (bx.max() + 1) + bx) * (by.max() + 1) + by) * 12 + \
+            rotation + 6
+        group[tile < 0] = -1
+        order = numpy.argsort(group, kind='stable')
+        starts = numpy.flatnonzero(numpy.diff(group[order], prepend=-2))
+        for start, end in zip(starts, list(starts[1:]) + [len(order)]):
+            at = order[start:end]
+            i = at[0]
+            if tile[i] < 0:  # past the edge of the layout
+                continue
+            tile_sampler = self._samplers(int(tile[i]), int(bx[i]),
+                                          int(by[i]))[int(rotation[i]) + 6]
+            # where _layout_blits puts the image, less its border
+            image_width, image_height = tile_sampler.size
+            if self.period is None:
+                left = numpy.round(x[at] - (image_width - 2) / 2) - 1
+                top = numpy.round(y[at] - (image_height - 2) / 2) - 1
+            else:
+                left = numpy.floor(x[at] - (image_width - 2) / 2 + 0.5) - 1
+                top = numpy.floor(y[at] - (image_height - 2) / 2 + 0.5) - 1
+            tu = u[at] - left
+            tv = v[at] - top
+            inside = ((tu >= 0) & (tu <= image_width - 1) &
+                      (tv >= 0) & (tv <= image_height - 1))
+            at, tu, tv = at[inside], tu[inside], tv[inside]
+            c, a = tile_sampler.sample(
+                tu, tv, filtering,
+                None if footprint is None else footprint[at])
+            colour[at] = c / 255
+            alpha[at] = a / 255
+        return colour, alpha
+
+    def _sample(self, u: numpy.ndarray, v: numpy.ndarray, filtering: str,
+                footprint: Optional[numpy.ndarray]
+                ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        u = numpy.mod(u, self.canvas_size[0])
+        v = numpy.mod(v, self.canvas_size[1])
+
+        # the tile images that could reach (u, v) are those of the nearest
+        # two rows of each of the nearest two columns
+        if self.period is None:
+            spacing = (self.tile_height / math.sqrt(3) * 3 / 2,
+                       self.tile_height / 2)
+        else:
+            spacing = (self.canvas_size[0] / self.period[0],
+                       self.canvas_size[1] / self.period[1])
+        col = numpy.floor(u / spacing[0]).astype(numpy.int64)
+        half_rows = numpy.floor(v / spacing[1]).astype(numpy.int64)
+        candidates = []
+        for c in (col, col + 1):
+            # rows of a column have the parity of the column
+            row = half_rows - (half_rows - c) % 2
+            candidates += [(row, c), (row + 2, c)]
+        # tiles are drawn row by row, and the rows are all different
+        rows = numpy.stack([row for row, _ in candidates])
+        cols = numpy.stack([c for _, c in candidates])
+        order = numpy.argsort(rows, axis=0)
+        rows = numpy.take_along_axis(rows, order, axis=0)
+        cols = numpy.take_along_axis(cols, order, axis=0)
+
+        # drawn over the background as pygame blits them
+        if self.background_colour is None:
+            colour = numpy.zeros((len(u), 3))
+            alpha = numpy.zeros(len(u))
+        else:
+            colour = numpy.tile(numpy.array(self.background_colour[:3]) / 255,
+                                (len(u), 1))
+            alpha = numpy.full(len(u), self.background_colour[3] / 255)
+        for row, c in zip(rows, cols):
+            tile_colour, tile_alpha = self._tile_sample(row, c, u, v,
+                                                        filtering, footprint)
+            # (pygame copies onto pixels that are still transparent)
+            clear = alpha == 0
+            colour += (tile_colour - colour) * tile_alpha[:, numpy.newaxis]
+            colour[clear] = tile_colour[clear]
+            alpha += tile_alpha * (1 - alpha)
+        return colour * 255, alpha * 255
+
+    def sample(self, u: numpy.ndarray, v: numpy.ndarray,
+               filtering: str = 'bilinear',
+               footprint: Optional[numpy.ndarray] = None
+               ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ (n, 3) colours and (n,) alphas, as floats in [0, 255], of the
+            plane at the 1d arrays u and v, as sampler.PlaneSampler.sample.
+            Each tile is filtered on its own, with its own mip pyramid. """
+        if filtering not in sampler.FILTERINGS:
+            raise ValueError(f"Unknown filtering '{filtering}'")
+        if filtering == 'trilinear' and footprint is None:
+            raise ValueError("trilinear filtering needs a footprint")
+        u = numpy.asarray(u, dtype=numpy.float64)
+        v = numpy.asarray(v, dtype=numpy.float64)
+        colour = numpy.empty((len(u), 3))
+        alpha = numpy.empty(len(u))
+        for start in range(0, len(u), SAMPLE_CHUNK):
+            end = start + SAMPLE_CHUNK
+            colour[start:end], alpha[start:end] = self._sample(
+                u[start:end], v[start:end], filtering,
+                None if footprint is None else footprint[start:end])
+        return colour, alpha
+
+
+def _padded_sampler(image: pygame.Surface) -> sampler.PlaneSampler:
+    """ A sampler for a tile image with a transparent border, so that
+        filtering at its edges fades out rather than wrapping around. """
+    width, height = image.get_size()
+    rgb = numpy.zeros((width + 2, height + 2, 3), dtype=numpy.uint8)
+    alpha = numpy.zeros((width + 2, height + 2), dtype=numpy.uint8)
+    rgb[1:-1, 1:-1] = pygame.surfarray.array3d(image)
+    alpha[1:-1, 1:-1] = pygame.surfarray.array_alpha(image)
+    return sampler.PlaneSampler(rgb, alpha)
+
+
+# the first entry of a .hexplane file, in case the format changes
+HEXPLANE_FORMAT = "hexplane 1"
+
+
+def save_hexplane(
+        path: str, tile_paths, canvas_size=(6400, 6400), tile_scale=1.0,
+        background_colour: Optional[pygame.Color]
+        = pygame.Color(255, 255, 255, 255),
+        toroidal=False, seed=None,
+        tile_levels: Optional[int] = None) -> None:
+    """ Saves the plane create_random_hexagonal_tiled_surface makes with the
+        same arguments to path, not as pixels but as what it's made of: the
+        scaled tile images and the layout (which image goes at each row and
+        column, turned which way), in a compressed numpy .npz file.  That's
+        10 KB for the 6400x6400 pink_plane of nested_spheres.py, against
+        6 MB as a PNG.  load_hexplane makes the plane again from it.
+        A callable tile is saved as an image for each of the tile_levels
+        steps it's used at, so callables need tile_levels.  As with
+        _save_checkpoint in project_to_torus.py, it's written to path + ".tmp"
+        first, so an interruption never leaves half a file.
+    """
+    if not isinstance(tile_paths, list):
+        tile_paths = [tile_paths]
+    scaled_tiles, _, tile_height, _ = _prepare_tiles(tile_paths, tile_scale,
+                                                     False)
+    if tile_levels is None and any(callable(t) for t in scaled_tiles):
+        raise ValueError("Saving a plane of callable tiles needs tile_levels")
+    layout = HexLayout.random(canvas_size, tile_height, len(scaled_tiles),
+                              toroidal, seed)
+
+    # the image for each tile, or each step of a callable tile, as
+    # _layout_blits makes them
+    width, height = canvas_size
+    x, y = layout.x, layout.y
+    if layout.period is not None:
+        x, y = x % width, y % height
+    steps = tile_levels or 1
+    bx = numpy.minimum((numpy.clip(x / width, 0, 1) * steps
+                        ).astype(numpy.int64), steps - 1)
+    by = numpy.minimum((numpy.clip(y / height, 0, 1) * steps
+                        ).astype(numpy.int64), steps - 1)
+    fixed = numpy.array([not callable(t) for t in scaled_tiles])[layout.tile]
+    bx[fixed] = 0
+    by[fixed] = 0
+    made, image = numpy.unique(numpy.stack([layout.tile, bx, by], axis=1),
+                               axis=0, return_inverse=True)
+    images = []
+    for tile, i, j in made.tolist():
+        scaled_tile = scaled_tiles[tile]
+        if callable(scaled_tile):
+            scaled_tile = pygame.transform.smoothscale_by(
+                scaled_tile((i + 0.5) / steps, (j + 0.5) / steps), tile_scale)
+        images.append(numpy.frombuffer(
+            pygame.image.tobytes(scaled_tile, "RGBA"), numpy.uint8
+        ).reshape(scaled_tile.get_height(), scaled_tile.get_width(), 4))
+
+    with open(path + ".tmp", "wb") as f:
+        numpy.savez_compressed(
+            f, format=HEXPLANE_FORMAT, canvas_size=canvas_size,
+            background_colour=() if background_colour is None
+            else tuple(pygame.Color(background_colour)),
+            toroidal=toroidal, images=numpy.stack(images),
+            row=layout.row.astype(numpy.int32),
+            col=layout.col.astype(numpy.int32),
+            tile=image.reshape(-1).astype(numpy.int32),
+            rotation=layout.rotation.astype(numpy.int8))
+    os.replace(path + ".tmp", path)
+
+
+def load_hexplane(path: str, lazy: bool = False):
+    """ The plane saved by save_hexplane, drawn as a Surface (as
+        create_random_hexagonal_tiled_surface drew it, pixel for pixel), or
+        if lazy, as a ProceduralHexPlane that draws only what's asked of it,
+        which the projectors and make_nest take in place of the Surface.
+        Loading lazily takes milliseconds. """
+    with numpy.load(path) as saved:
+        if str(saved['format']) != HEXPLANE_FORMAT:
+            raise ValueError(f"{path} is not a {HEXPLANE_FORMAT} file")
+        canvas_size = tuple(saved['canvas_size'].tolist())
+        background_colour = tuple(saved['background_colour'].tolist()) or None
+        toroidal = bool(saved['toroidal'])
+        images = [pygame.image.frombytes(image.tobytes(),
+                                         (image.shape[1], image.shape[0]),
+                                         "RGBA")
+                  for image in saved['images']]
+        row, col = saved['row'].astype(numpy.int64), \
+            saved['col'].astype(numpy.int64)
+        tile = saved['tile'].astype(numpy.int64)
+        rotation = saved['rotation'].astype(numpy.int64)
+
+    tile_height = images[0].get_height() - 1  # as _prepare_tiles has it
+    period = HexLayout.fundamental_period(canvas_size, tile_height) \
+        if toroidal else None
+    layout = HexLayout(canvas_size, tile_height, row, col, tile, rotation,
+                       period)
+    if lazy:
+        return ProceduralHexPlane(images, canvas_size, 1.0, background_colour,
+                                  toroidal, layout=layout)
+
+    _, atlases, _, reach = _prepare_tiles(images, 1.0, True)
+    canvas = _draw_region(layout, images, atlases, 1.0, None,
+                          background_colour, (0, 0, *canvas_size), reach)
     sys.stdout.write(f"\rRandom-plane Done.")  # Overwrite the progress line
     sys.stdout.flush()
     return canvas
 
 
+def _graded_tile(colour1, colour2, x, y) -> pygame.Surface:
+    # colour1 in top left -> colour2 in bottom right
+    d00 = abs(x) + abs(y)
+    return rainbow_tile.pink_tile(
+        rainbow_tile.blend_colours(colour1, colour2, d00 / 2))
+
+
 def graded_colour_plane(
         colour1=pygame.Color(255, 0, 255, 255),  # pink
         colour2=pygame.Color(0, 255, 255, 255),  # cyan,
         canvas_size=(6400, 6400),  # default canvas size
-        tile_scale=1.0
+        tile_scale=1.0,
+        tile_levels=None,  # e.g. 16 to reuse tiles, see below
+        seed=None,
+        workers=1
 ) -> pygame.Surface:
     """
     Generates a gradient-based hexagonal tiled image surface by blending two colors.
@@ -241,23 +1134,26 @@ def graded_colour_plane(
                                 to cyan pygame.Color(0, 255, 255, 255).
         tile_scale (float): A scaling factor for the size of the hexagonal tiles.
                             Higher values increase the tile size, defaults to 1.0.
+        tile_levels (Optional[int]): If given, the gradient is made in this
+                            many steps each way, and each step's tile is only
+                            drawn once (see
+                            create_random_hexagonal_tiled_surface).
+        seed, workers: as for create_random_hexagonal_tiled_surface.
 
     Returns:
         pygame.Surface: The generated hexagonal tiled surface with a gradient
                         based on the provided colors.
     """
 
-    def tile(x, y) -> pygame.Surface:
-        # colour1 in top left -> colour2 in bottom right
-        d00 = abs(x) + abs(y)
-        return rainbow_tile.pink_tile(
-            rainbow_tile.blend_colours(colour1, colour2, d00 / 2))
-
+    tile = functools.partial(_graded_tile, colour1, colour2)
     canvas = create_random_hexagonal_tiled_surface(tile,
                                                    background_colour=pygame.Color(
                                                        0, 0, 0, 0),
                                                    canvas_size=canvas_size,
-                                                   tile_scale=tile_scale)
+                                                   tile_scale=tile_scale,
+                                                   tile_levels=tile_levels,
+                                                   seed=seed,
+                                                   workers=workers)
     pygame.image.save(canvas, "output.png")
     return canvas
 
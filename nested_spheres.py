@@ -1,5 +1,6 @@
 import sys
 import os
+import math
 import random
 
 import pygame
@@ -9,23 +10,22 @@ import project_to_sphere
 import brain_tile
 import rainbow_tile
 import show_canvas
+import frames
 
 
-def make_nest(plane,  # plane to be wrapped on each shell
-              radius=1200,  # radius of the outermost shell
-              num_layers=4,  # there are this many layers of spherical shell
-              shrink=0.9,  # each layer is this much smaller
-              base_shadow=0.3,  # outer layer has this much shade
-              shadow_factor=1.5,  # each shadow darkens by this amount
-              paper_colour=pygame.Color(255, 255, 255, 255),
-              behind_sphere=pygame.Color(50, 50, 50, 255)
-              ):
+def _nest_background(radius, paper_colour, behind_sphere) -> pygame.Surface:
     sphere_surface = pygame.Surface((2 * radius, 2 * radius),
                                     pygame.SRCALPHA)
     sphere_surface.fill(paper_colour)
     pygame.draw.circle(sphere_surface, behind_sphere,
                        center=(radius, radius), radius=radius, width=0)
+    return sphere_surface
+
 
+def _nest_shells(plane, radius, num_layers, shrink, base_shadow,
+                 shadow_factor):
+    """ (radius, shadow, centre_xy, centre_z) of each shell of a nest, from the
+        innermost out, choosing random centres for all but the outer shell. """
     # assume we need 4*radius pixels of the plane for each projection, choose
     # a random point in the surface to centre the sphere
     def random_point(surface) -> (float, float):
@@ -34,40 +34,146 @@ def make_nest(plane,  # plane to be wrapped on each shell
             (pw - radius * 4) * random.random() + radius * 2,
             (pw - radius * 4) * random.random() + radius * 2)
 
+    shells = []
     for i in range(num_layers - 1, 0, -1):
-        print(f"Layer {num_layers - i} of {num_layers}")
-        sphere_surface = project_to_sphere.project_image_to_sphere(
-            sphere_surface, plane, round(radius * shrink ** i),
-            base_shadow * shadow_factor ** i,
-            sphere_centre_xy=random_point(plane),
-            sphere_centre_z=radius * shrink ** i)
+        shells.append((round(radius * shrink ** i),
+                       base_shadow * shadow_factor ** i,
+                       random_point(plane),
+                       radius * shrink ** i))
+
+    pw, ph = plane.get_size()
+    shells.append((round(radius * shrink ** 0), base_shadow,
+                   (pw / 2, ph / 2), round(radius * shrink ** 0)))
+    return shells
 
-    print(f"Final Layer of {num_layers}")
-    sphere_surface = project_to_sphere.project_image_to_sphere(
-        sphere_surface, plane, round(radius * shrink ** 0), base_shadow)
+
+def make_nest(plane,  # plane to be wrapped on each shell
+              radius=1200,  # radius of the outermost shell
+              num_layers=4,  # there are this many layers of spherical shell
+              shrink=0.9,  # each layer is this much smaller
+              base_shadow=0.3,  # outer layer has this much shade
+              shadow_factor=1.5,  # each shadow darkens by this amount
+              paper_colour=pygame.Color(255, 255, 255, 255),
+              behind_sphere=pygame.Color(50, 50, 50, 255),
+              lut_directory=None,  # directory to cache sphere geometry in
+              fused=False,  # all shells in one pass, see below
+              workers=1  # render shells in this many processes
+              ):
+    """ Wraps the plane on num_layers nested, partly transparent spheres.
+        Normally each shell is projected and blitted in turn.  With fused=True
+        they are composited in a single pass instead (see
+        project_to_sphere.project_image_to_nested_spheres), which skips the
+        full-size layer per shell and the shells hidden behind opaque pixels,
+        and gives the same image.
+        With workers > 1 the shells are rendered concurrently in a process
+        pool and composited in order as they arrive, giving the same image
+        as rendering them one after another.
+        A plane that can draw regions of itself, like a
+        hextiles.ProceduralHexPlane, is only drawn in the window each shell
+        samples (see project_to_sphere.shell_plane), and those match the
+        whole plane pixel for pixel.  The fused pass samples it instead.
+        The fused pass is a single process that doesn't use sphere LUTs, so
+        fused=True with workers > 1 or a lut_directory raises ValueError. """
+    if fused and workers > 1:
+        raise ValueError("fused=True renders in one process, not workers")
+    if fused and lut_directory is not None:
+        raise ValueError("fused=True doesn't use sphere LUTs, so can't cache "
+                         "them in lut_directory")
+
+    sphere_surface = _nest_background(radius, paper_colour, behind_sphere)
+
+    shells = _nest_shells(plane, radius, num_layers, shrink, base_shadow,
+                          shadow_factor)
+    if fused:
+        return project_to_sphere.project_image_to_nested_spheres(
+            sphere_surface, plane, shells)
+
+    if workers > 1:
+        layers = project_to_sphere.project_shells(plane, shells, workers,
+                                                  lut_directory)
+        for i, ((shell_radius, _, _, _), layer) in enumerate(
+                zip(shells, layers)):
+            print(f"Layer {i + 1} of {num_layers}")
+            project_to_sphere.composite_layer(sphere_surface, layer,
+                                              shell_radius)
+        return sphere_surface
+
+    for i, (shell_radius, shadow, centre_xy, centre_z) in enumerate(shells):
+        if i < num_layers - 1:
+            print(f"Layer {i + 1} of {num_layers}")
+        else:
+            print(f"Final Layer of {num_layers}")
+        shell_plane, centre_xy = project_to_sphere.shell_plane(
+            plane, shell_radius, centre_xy, centre_z)
+        sphere_surface = project_to_sphere.project_image_to_sphere(
+            sphere_surface, shell_plane, shell_radius, shadow,
+            sphere_centre_xy=centre_xy,
+            sphere_centre_z=centre_z,
+            lut_directory=lut_directory)
 
     return sphere_surface
 
 
+def nest_frames(plane,  # plane to be wrapped on each shell
+                num_frames=360,  # length of the clip
+                degrees_per_frame=1.0,  # each shell turns this much a frame
+                direction=(1.0, 0.0),  # the plane moves this way under them
+                radius=600,  # radius of the outermost shell
+                num_layers=4,  # there are this many layers of spherical shell
+                shrink=0.9,  # each layer is this much smaller
+                base_shadow=0.3,  # outer layer has this much shade
+                shadow_factor=1.5,  # each shadow darkens by this amount
+                paper_colour=pygame.Color(255, 255, 255, 255),
+                behind_sphere=pygame.Color(50, 50, 50, 255),
+                filtering='nearest',  # see sampler.py
+                lut_directory=None  # directory to cache sphere geometry in
+                ):
+    """ Frames of a turntable clip of a nest, as made by make_nest, with all
+        the shells turning together.  The geometry of each shell is worked out
+        once, and the frames are made one at a time as they are asked for,
+        so they can go straight to disk (see frames.py). """
+    background = _nest_background(radius, paper_colour, behind_sphere)
+    shells = _nest_shells(plane, radius, num_layers, shrink, base_shadow,
+                          shadow_factor)
+
+    # near the pole, turning a sphere by a small angle moves the plane under
+    # it by about (radius + centre_z) / 2 times that angle
+    length = math.hypot(*direction)
+    paths = []
+    for shell_radius, shadow, (cx, cy), centre_z in shells:
+        step = math.radians(degrees_per_frame) * (shell_radius + centre_z) / 2
+        dx, dy = (step * direction[0] / length, step * direction[1] / length)
+        paths.append(project_to_sphere.sphere_frames(
+            plane, shell_radius,
+            [(cx + dx * frame, cy + dy * frame) for frame in range(num_frames)],
+            shadow, centre_z, filtering, lut_directory))
+
+    for layers in zip(*paths):
+        sphere_surface = background.copy()
+        for (shell_radius, _, _, _), layer in zip(shells, layers):
+            sphere_surface.blit(layer, (radius - shell_radius,
+                                        radius - shell_radius),
+                                special_flags=pygame.BLEND_ALPHA_SDL2)
+        yield sphere_surface
+
+
 def pink_sphere():
     # create pink_tile.png if it doesn't already exist
     if not os.path.exists("pink_tile.png"):
         tile = rainbow_tile.pink_tile()
         pygame.image.save(tile, "pink_tile.png")
-        os.remove("pink_plane.png")
 
-    # create pink_plane.png if it doesn't already exist, or is older than
-    # the pink_tile.pnk
-    if (not os.path.exists("pink_plane.png") or
-            os.path.getmtime("pink_plane.png") <
+    # create pink_plane.hexplane if it doesn't already exist, or is older than
+    # the pink_tile.png.  It's the tile and where it goes, not the pixels, so
+    # it's small, and loading it lazily draws only what the shells sample.
+    if (not os.path.exists("pink_plane.hexplane") or
+            os.path.getmtime("pink_plane.hexplane") <
             os.path.getmtime("pink_tile.png")):
-        pink_plane = hextiles.create_random_hexagonal_tiled_surface(
-            "pink_tile.png", (6400, 6400), 0.25,
+        hextiles.save_hexplane(
+            "pink_plane.hexplane", "pink_tile.png", (6400, 6400), 0.25,
             pygame.Color(0, 0, 0, 0)
         )
-        pygame.image.save(pink_plane, "pink_plane.png")
-    else:
-        pink_plane = pygame.image.load("pink_plane.png")
+    pink_plane = hextiles.load_hexplane("pink_plane.hexplane", lazy=True)
 
     sphere = make_nest(pink_plane)
     pygame.image.save(sphere, "pink_sphere.png")
@@ -93,16 +199,15 @@ def brain_sphere():
     if not os.path.exists("brain_tile.png"):
         tile = brain_tile.brain_tile()
         pygame.image.save(tile, "brain_tile.png")
-        os.remove("brain_plane.png")
+        if os.path.exists("brain_plane.hexplane"):
+            os.remove("brain_plane.hexplane")
 
-    if os.path.exists("brain_plane.png"):
-        plane = pygame.image.load("brain_plane.png")
-    else:
-        plane = hextiles.create_random_hexagonal_tiled_surface(
-            "brain_tile.png", (6400, 6400), 1.0,
+    if not os.path.exists("brain_plane.hexplane"):
+        hextiles.save_hexplane(
+            "brain_plane.hexplane", "brain_tile.png", (6400, 6400), 1.0,
             pygame.Color(0, 0, 0, 0)
         )
-        pygame.image.save(plane, "brain_plane.png")
+    plane = hextiles.load_hexplane("brain_plane.hexplane", lazy=True)
 
     sphere = make_nest(plane,
                        shrink=0.8, num_layers=6,
@@ -115,16 +220,15 @@ def rainbow_sphere():
     if not os.path.exists("rainbow_tile.png"):
         tile = rainbow_tile.rainbow_tile()
         pygame.image.save(tile, "rainbow_tile.png")
-        os.remove("rainbow_plane.png")
+        if os.path.exists("rainbow_plane.hexplane"):
+            os.remove("rainbow_plane.hexplane")
 
-    if os.path.exists("rainbow_plane.png"):
-        plane = pygame.image.load("rainbow_plane.png")
-    else:
-        plane = hextiles.create_random_hexagonal_tiled_surface(
-            "rainbow_tile.png", (6400, 6400), 0.5,
+    if not os.path.exists("rainbow_plane.hexplane"):
+        hextiles.save_hexplane(
+            "rainbow_plane.hexplane", "rainbow_tile.png", (6400, 6400), 0.5,
             background_colour=pygame.Color(0, 0, 0, 0)
         )
-        pygame.image.save(plane, "rainbow_plane.png")
+    plane = hextiles.load_hexplane("rainbow_plane.hexplane", lazy=True)
 
     sphere = make_nest(plane)
     pygame.image.save(sphere, "rainbow_spheres.png")
@@ -141,19 +245,17 @@ def twig_tile():
 
 def leafy_sphere():
     base_name = "leafy"
-    plane_name = f"{base_name}_plane.png"
+    plane_name = f"{base_name}_plane.hexplane"
     sphere_name = f"{base_name}_sphere.png"
 
-    if os.path.exists(plane_name):
-        plane = pygame.image.load(plane_name)
-    else:
+    if not os.path.exists(plane_name):
         tiles = f"leafy_tile.png"
-        plane = hextiles.create_random_hexagonal_tiled_surface(
-            tiles, (6400, 6400), 0.25,
+        hextiles.save_hexplane(
+            plane_name, tiles, (6400, 6400), 0.25,
             pygame.Color(0, 0, 0, 0)
         )
-        pygame.image.save(plane, plane_name)
-        # show_canvas.show_canvas(plane, (600, 600))
+    plane = hextiles.load_hexplane(plane_name, lazy=True)
+    # show_canvas.show_canvas(plane.region(0, 0, 600, 600), (600, 600))
 
     sphere = make_nest(plane,
                        behind_sphere=pygame.Color("black"))
@@ -161,9 +263,37 @@ def leafy_sphere():
     show_canvas.show_canvas(sphere, (600, 600))
 
 
+def procedural_pink_sphere():
+    # as pink_sphere, but the plane is only made where the spheres sample it,
+    # so there's no 6400x6400 plane in memory (or on disk)
+    if not os.path.exists("pink_tile.png"):
+        pygame.image.save(rainbow_tile.pink_tile(), "pink_tile.png")
+    plane = hextiles.ProceduralHexPlane(
+        "pink_tile.png", (6400, 6400), 0.25, pygame.Color(0, 0, 0, 0), seed=0)
+
+    sphere = make_nest(plane)
+    pygame.image.save(sphere, "procedural_pink_sphere.png")
+    show_canvas.show_canvas(sphere, (600, 600))
+
+
+def pink_turntable(size=600, num_frames=360):
+    # a turning pink nest, as an mp4 if ffmpeg is installed
+    if not os.path.exists("pink_plane.hexplane"):
+        pink_sphere()
+    plane = hextiles.load_hexplane("pink_plane.hexplane")
+
+    clip = nest_frames(plane, num_frames=num_frames, radius=size // 2)
+    frames.pipe_frames(clip, frames.ffmpeg_command((size, size),
+                                                   "pink_turntable.mp4"))
+    # or, as numbered png files:
+    # frames.save_frames(clip, "pink_turntable_{:04d}.png")
+
+
 # pink_sphere()
 # yellow_cyan_sphere()
 # brain_sphere()
 # rainbow_sphere()
 # twig_tile()
 # leafy_sphere()
+# procedural_pink_sphere()
+# pink_turntable()
@@ -0,0 +1,54 @@
+import struct
+import zlib
+
+
+# Writing a PNG a few rows at a time, for images too big to hold in memory at
+# once (see hextiles.save_hexagonal_tiled_plane).  Only 8 bit RGBA is written,
+# without filtering, which pygame.image.load (and anything else) can read.
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return (struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data)))
+
+
+class PNGWriter(object):
+    """ An RGBA PNG of the given size, written to a file as rows are added.
+        The rows must add up to the height before close. """
+
+    def __init__(self, file, size, compression: int = 6):
+        self.file = file
+        self.width, self.height = size
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compression)
+        file.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits, colour type 6 (RGBA), default compression, no filter,
+        # not interlaced
+        file.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", self.width,
+                                               self.height, 8, 6, 0, 0, 0)))
+
+    def write_rows(self, rgba: bytes) -> None:
+        """ Adds whole rows of RGBA bytes, top to bottom, as
+            pygame.image.tobytes(surface, "RGBA") gives them. """
+        stride = self.width * 4
+        if len(rgba) % stride:
+            raise ValueError("Not a whole number of rows")
+        rows = len(rgba) // stride
+        # each row starts with its filter type, 0 for none
+        data = bytearray(rows * (stride + 1))
+        for i in range(rows):
+            data[i * (stride + 1) + 1:(i + 1) * (stride + 1)] = \
+                rgba[i * stride:(i + 1) * stride]
+        self._idat(self.compressor.compress(bytes(data)))
+        self.rows_written += rows
+
+    def close(self) -> None:
+        if self.rows_written != self.height:
+            raise ValueError(f"{self.rows_written} rows written of "
+                             f"{self.height}")
+        self._idat(self.compressor.flush())
+        self.file.write(_chunk(b"IEND", b""))
+
+    def _idat(self, data: bytes) -> None:
+        if data:
+            self.file.write(_chunk(b"IDAT", data))
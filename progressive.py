@@ -0,0 +1,100 @@
+import time
+from typing import Iterator, List, Tuple
+
+import numpy
+
+
+# Coarse-to-fine rendering, shared by the sphere and torus projectors.  The
+# first pass renders every stride'th pixel of every stride'th row of the
+# output, and each later pass halves the stride and renders just the pixels
+# that are new at that stride, so every pixel is rendered once and the last
+# pass finishes the full image.  After each pass the pixels not yet rendered
+# are filled in from the rendered one above and to the left of them, for a
+# blocky but complete preview.
+
+PREVIEW_STRIDE = 8
+
+
+def pass_pixels(size: Tuple[int, int], stride: int = PREVIEW_STRIDE
+                ) -> Iterator[Tuple[int, numpy.ndarray, numpy.ndarray]]:
+    """ (stride, x, y) for each pass: the stride it leaves the image at, and
+        1d arrays of the pixels to render in it.  stride should be a power of
+        2. """
+    width, height = size
+    x, y = numpy.meshgrid(numpy.arange(0, width, stride),
+                          numpy.arange(0, height, stride), indexing='ij')
+    yield stride, x.ravel(), y.ravel()
+
+    while stride > 1:
+        stride //= 2
+        x, y = numpy.meshgrid(numpy.arange(0, width, stride),
+                              numpy.arange(0, height, stride), indexing='ij')
+        new = (x % (2 * stride) != 0) | (y % (2 * stride) != 0)
+        yield stride, x[new], y[new]
+
+
+def fill_in(image: numpy.ndarray, stride: int) -> numpy.ndarray:
+    """ A copy of an image ([x, y, ...] like surfarray) whose pixels on the
+        stride grid are rendered, with each stride by stride block filled in
+        from its top left pixel. """
+    if stride == 1:
+        return image.copy()
+    width, height = image.shape[:2]
+    coarse = image[::stride, ::stride]
+    return coarse.repeat(stride, axis=0).repeat(stride, axis=1)[:width,
+                                                                :height]
+
+
+def pass_counts(size: Tuple[int, int], stride: int = PREVIEW_STRIDE
+                ) -> List[int]:
+    """ The number of pixels rendered in each pass of pass_pixels. """
+    def on_grid(s):
+        return -(-size[0] // s) * -(-size[1] // s)
+
+    counts = [on_grid(stride)]
+    while stride > 1:
+        stride //= 2
+        counts.append(on_grid(stride) - on_grid(2 * stride))
+    return counts
+
+
+def first_stride(size: Tuple[int, int], rate: float, seconds: float,
+                 largest: int = 64) -> int:
+    """ The finest stride, from PREVIEW_STRIDE up to largest, whose first
+        pass would take at most a quarter of seconds (the time left, which
+        may be none) at rate pixels a second.  The coarsest if none would. """
+    stride = PREVIEW_STRIDE
+    while stride < largest and pass_counts(size, stride)[0] / rate > \
+            seconds / 4:
+        stride *= 2
+    return stride
+
+
+def within(images: Iterator, size: Tuple[int, int], stride: int,
+           seconds: float, started: float) -> Tuple[object, int]:
+    """ Takes images from a progressive render (made with this size and
+        stride) until the next pass wouldn't be done by started + seconds
+        (on the time.perf_counter clock).  A pass is reckoned to take a fixed
+        time (making the preview) plus a time per pixel, fitted to the passes
+        so far.  The first pass is always taken.  Returns the last image, and
+        the stride it reached (1 if it's finished). """
+    counts = pass_counts(size, stride)
+    times = []
+    image = None
+    for i, count in enumerate(counts):
+        if i == 1:
+            per_pixel, fixed = times[0] / counts[0], 0.0
+        elif i > 1:
+            per_pixel, fixed = numpy.polyfit(counts[:i], times, 1)
+            if per_pixel <= 0:
+                per_pixel, fixed = times[-1] / counts[i - 1], 0.0
+        if i > 0 and (time.perf_counter() - started +
+                      max(fixed, 0.0) + per_pixel * count > seconds):
+            break
+        start = time.perf_counter()
+        image = next(images)
+        times.append(time.perf_counter() - start)
+        if i > 0:
+            stride //= 2
+    images.close()
+    return image, stride
@@ -1,11 +1,20 @@
 import sys
 import math
-from typing import Optional, Tuple
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator, List, Optional, Tuple
 
+import numpy
 import pygame
 from pygame.math import clamp
 from sympy import ceiling
 
+import array_cache
+import progressive
+import sampler
+from sampler import surface_rgb_alpha
+
 
 def project_image_to_sphere(
         sphere_surface: Optional[pygame.Surface],
@@ -13,7 +22,11 @@ def project_image_to_sphere(
         radius: float,
         shadow_amount: float = 0.3,
         sphere_centre_xy: Optional[Tuple[float, float]] = None,
-        sphere_centre_z: Optional[float] = None) -> pygame.Surface:
+        sphere_centre_z: Optional[float] = None,
+        engine: str = 'numpy',
+        lut_directory: Optional[str] = None,
+        workers: int = 1,
+        filtering: str = 'nearest') -> pygame.Surface:
     """ Given an image on a surface, wrap it around a sphere and project that
     orthogonally and centrally on a square plane of side ceiling(2 * radius).
     The wrapping is a stereographic projection of the plane onto the southern
@@ -24,19 +37,81 @@ def project_image_to_sphere(
     If the sphere centre is not given, it is one radius above the image centre.
         If given, x and y are in image plane coordinates, and z is distance
         above the plane.
+    engine can be 'numpy' (whole-array, the default) or 'python' (the original
+        per-pixel loop).  Both give the same pixels.
+    The numpy engine keeps the sphere geometry in a SphereLUT, which is reused
+        by later calls with the same radius, centre height and shadow.  If
+        lut_directory is given, LUTs are also saved there as .npy files, so
+        later runs can use them too.
+    If workers > 1, the numpy engine instead splits the layer into horizontal
+        bands and renders them in that many processes, with the plane (and,
+        for trilinear filtering, its mip pyramid) and the layer in shared
+        memory.  The geometry is not cached in this case.
+    filtering is how the plane is sampled: 'nearest' (the default, as the
+        per-pixel loop does), 'bilinear' or 'trilinear', which uses a mip
+        pyramid of the plane to avoid aliasing near the rim.  See sampler.py.
+        The pyramid is kept for later calls, and made again if the plane has
+        been drawn on since (see sampler.sampler_for).
+    plane can also be procedural (see hextiles.ProceduralHexPlane), made just
+        where the sphere samples it rather than held whole in memory.
     """
 
     width, height = plane.get_size()
 
-    layer = pygame.Surface((int(ceiling(2 * radius)), int(ceiling(2 * radius))),
-                           pygame.SRCALPHA)
-    layer.fill((0, 0, 0, 0))
-
     cx, cy = (width / 2, height / 2) \
         if (sphere_centre_xy is None) \
         else sphere_centre_xy
     cz = radius if sphere_centre_z is None else sphere_centre_z
 
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
+    if filtering != 'nearest' and engine != 'numpy':
+        raise ValueError(f"{filtering} filtering needs the numpy engine")
+
+    if engine == 'numpy' and workers > 1:
+        layer = _project_layer_banded(plane, radius, shadow_amount, cx, cy, cz,
+                                      workers, filtering)
+    elif engine == 'numpy':
+        lut = sphere_lut(radius, cz, shadow_amount, lut_directory)
+        layer = lut.render(plane, cx, cy, filtering)
+    elif engine == 'python' and workers > 1:
+        raise ValueError("workers > 1 needs the numpy engine")
+    elif engine == 'python':
+        layer = _project_layer_python(plane, radius, shadow_amount, cx, cy, cz)
+    else:
+        raise ValueError(f"Unknown sphere engine '{engine}'")
+
+    if sphere_surface is None:
+        return layer
+
+    # otherwise, composite the layer with the existing surface
+    composite_layer(sphere_surface, layer, radius)
+
+    sys.stdout.write("\r")  # Clear the progress line
+    sys.stdout.flush()  # Ensure the progress line gets updated immediately
+    return sphere_surface
+
+
+def composite_layer(sphere_surface: pygame.Surface, layer: pygame.Surface,
+                    radius: float) -> None:
+    """ Blends a projected layer onto the centre of sphere_surface. """
+    offset_x = sphere_surface.get_width() / 2 - radius
+    offset_y = sphere_surface.get_height() / 2 - radius
+    sphere_surface.blit(layer, (offset_x, offset_y),
+                        special_flags=pygame.BLEND_ALPHA_SDL2)
+
+
+def _project_layer_python(plane: pygame.Surface, radius: float,
+                          shadow_amount: float,
+                          cx: float, cy: float, cz: float) -> pygame.Surface:
+    """ The per-pixel implementation of project_image_to_sphere, returning
+        just the projected layer. """
+    width, height = plane.get_size()
+
+    layer = pygame.Surface((int(ceiling(2 * radius)), int(ceiling(2 * radius))),
+                           pygame.SRCALPHA)
+    layer.fill((0, 0, 0, 0))
+
     # looping over projected image
     num_tiles_y = int(ceiling(2 * radius))
     for y in range(num_tiles_y, 0, -1):
@@ -95,20 +170,665 @@ def project_image_to_sphere(
             # Set the pixel
             layer.set_at((x, y), pixel_colour)
 
-    if sphere_surface is None:
+    return layer
+
+
+def _sphere_geometry(dx: numpy.ndarray, dy: numpy.ndarray, radius: float,
+                     cz: float, shadow_amount: float
+                     ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray,
+                                Optional[numpy.ndarray]]:
+    """ (u offset, v offset, footprint, shade) for layer pixels at (dx, dy)
+        from the centre of a sphere, all inside it.  See SphereLUT. """
+    distance_squared = dx * dx + dy * dy
+    s = numpy.sqrt(distance_squared)
+    sin_ratio = numpy.clip(s / radius, 0, 1)
+
+    # angle subtended at north pole, and distance to original point
+    theta = 0.5 * numpy.arcsin(sin_ratio)
+    d = (radius + cz) * numpy.tan(theta)
+    centre = distance_squared < 1e-6
+    scale = numpy.divide(d, s, out=numpy.zeros_like(d), where=~centre)
+
+    # stretch of the plane along and across the radius.  Radially it
+    # grows without limit towards the rim.
+    with numpy.errstate(divide='ignore'):
+        radial = 0.5 * (radius + cz) / numpy.cos(theta) ** 2 / numpy.sqrt(
+            numpy.maximum(radius * radius - distance_squared, 0))
+    across = numpy.where(centre, 0.5 * (radius + cz) / radius, scale)
+    footprint = numpy.maximum(radial, across).astype(numpy.float32)
+
+    # Attached Shadow, as in the per-pixel version
+    shade = None
+    if shadow_amount > 0:
+        light_lat = - math.pi / 4
+        light_lon = - math.pi / 4
+        latitude = numpy.arccos(sin_ratio)
+        longitude = numpy.arctan2(dx, dy)
+
+        def hav(angle):
+            return 0.5 * (1 - numpy.cos(angle))
+
+        hav_theta = hav(light_lat - latitude) + numpy.cos(
+            latitude) * math.cos(light_lat) * hav(light_lon - longitude)
+        ang_diff = numpy.arccos(numpy.clip(1 - 2 * hav_theta, -1, 1))
+        shade = numpy.clip(ang_diff / (2 * math.pi * shadow_amount), 0, 1)
+
+    # rounded to float32, as SphereLUT keeps them, so that every way of
+    # rendering a sphere sees the same geometry
+    def single(a):
+        return None if a is None else a.astype(numpy.float32).astype(
+            numpy.float64)
+
+    return single(dx * scale), single(dy * scale), footprint, single(shade)
+
+
+def _shaded_nearest(plane_rgb: numpy.ndarray, plane_alpha: numpy.ndarray,
+                    u: numpy.ndarray, v: numpy.ndarray,
+                    shade: Optional[numpy.ndarray]
+                    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """ (n, 3) colours and (n,) alphas of the plane pixels containing (u, v),
+        with the colours shaded, as the per-pixel loop does. """
+    width, height = plane_alpha.shape
+    uu = numpy.floor(numpy.mod(0.5 + u, width)).astype(numpy.intp)
+    vv = numpy.floor(numpy.mod(0.5 + v, height)).astype(numpy.intp)
+    # float modulo can land exactly on the upper bound
+    uu[uu >= width] = 0
+    vv[vv >= height] = 0
+
+    colour = plane_rgb[uu, vv]
+    alpha = plane_alpha[uu, vv]
+
+    if shade is not None:
+        colour = numpy.round(colour * shade[:, numpy.newaxis])
+    return colour.astype(numpy.uint8), alpha
+
+
+def _shaded_filtered(plane_sampler: sampler.PlaneSampler,
+                     u: numpy.ndarray, v: numpy.ndarray, filtering: str,
+                     footprint: numpy.ndarray, shade: Optional[numpy.ndarray]
+                     ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """ As _shaded_nearest, but with a filtered sample of the plane. """
+    colour, alpha = plane_sampler.sample(u, v, filtering, footprint)
+    if shade is not None:
+        colour = colour * shade[:, numpy.newaxis]
+    return (numpy.round(colour).astype(numpy.uint8),
+            numpy.round(alpha).astype(numpy.uint8))
+
+
+class SphereLUT(object):
+    """ The per-pixel geometry of a projected sphere of a given radius, centre
+        height and shadow amount: which layer pixels are inside the sphere,
+        the offset of each from the sphere centre in the plane, and its shade.
+        Only sphere_centre_xy is left to choose, so rendering any plane with it
+        is a gather plus a multiply.
+    """
+
+    def __init__(self, inside: numpy.ndarray,
+                 u_offset: numpy.ndarray, v_offset: numpy.ndarray,
+                 footprint: numpy.ndarray, shade: Optional[numpy.ndarray]):
+        self.size = inside.shape[0]
+        self.inside = inside  # (size, size) bool, indexed [x, y]
+        # these are 1d float32, one entry per True in inside
+        self.u_offset = u_offset
+        self.v_offset = v_offset
+        # plane pixels covered by the layer pixel, for filtered sampling
+        self.footprint = footprint
+        self.shade = shade  # None if there is no shadow
+
+    @staticmethod
+    def compute(radius: float, cz: float, shadow_amount: float,
+                rows: Optional[Tuple[int, int]] = None) -> 'SphereLUT':
+        """ Work out the geometry, as the per-pixel loop would.  If rows
+            (y0, y1) is given, only that band of the layer is covered, and
+            inside has y1 - y0 columns. """
+        size = int(ceiling(2 * radius))
+        y0, y1 = (0, size) if rows is None else rows
+
+        # arrays are indexed [x, y], like surfarray.  The per-pixel loop never
+        # reaches row 0, so neither do we.
+        dx = (numpy.arange(size, dtype=numpy.float64) - radius)[:, numpy.newaxis]
+        dy = (numpy.arange(y0, y1, dtype=numpy.float64) - radius)[numpy.newaxis, :]
+        distance_squared = dx * dx + dy * dy
+        inside = distance_squared <= radius * radius
+        if y0 == 0:
+            inside[:, 0] = False
+
+        dx = numpy.broadcast_to(dx, inside.shape)[inside]
+        dy = numpy.broadcast_to(dy, inside.shape)[inside]
+        u_offset, v_offset, footprint, shade = _sphere_geometry(
+            dx, dy, radius, cz, shadow_amount)
+        return SphereLUT(inside, u_offset.astype(numpy.float32),
+                         v_offset.astype(numpy.float32), footprint,
+                         None if shade is None else shade.astype(numpy.float32))
+
+    def offsets(self, angle: float = 0.0
+                ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ (u, v) offsets with the plane turned by angle radians about the
+            sphere centre, as float64 for adding to it. """
+        u_offset = self.u_offset.astype(numpy.float64)
+        v_offset = self.v_offset.astype(numpy.float64)
+        if angle == 0:
+            return u_offset, v_offset
+        c, s = math.cos(angle), math.sin(angle)
+        return (c * u_offset - s * v_offset,
+                s * u_offset + c * v_offset)
+
+    def _shade(self) -> Optional[numpy.ndarray]:
+        return None if self.shade is None else \
+            self.shade.astype(numpy.float64)
+
+    def gather(self, plane_rgb: numpy.ndarray, plane_alpha: numpy.ndarray,
+               cx: float, cy: float, angle: float = 0.0
+               ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ Shaded (n, 3) colours and (n,) alphas for the inside pixels, from
+            the plane's surfarray-style colour and alpha arrays, with the
+            sphere centre above (cx, cy) and the plane turned by angle. """
+        u_offset, v_offset = self.offsets(angle)
+        return _shaded_nearest(plane_rgb, plane_alpha, cx + u_offset,
+                               cy + v_offset, self._shade())
+
+    def sample(self, plane_sampler: sampler.PlaneSampler,
+               cx: float, cy: float, filtering: str, angle: float = 0.0
+               ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ As gather, but with a filtered sample of the plane. """
+        u_offset, v_offset = self.offsets(angle)
+        return _shaded_filtered(plane_sampler, cx + u_offset, cy + v_offset,
+                                filtering, self.footprint, self._shade())
+
+    def render(self, plane: pygame.Surface, cx: float, cy: float,
+               filtering: str = 'nearest',
+               angle: float = 0.0) -> pygame.Surface:
+        """ The projected layer for the plane, with the sphere centre above
+            (cx, cy) and the plane turned by angle radians about it. """
+        layer = pygame.Surface((self.size, self.size), pygame.SRCALPHA)
+        layer.fill((0, 0, 0, 0))
+
+        if filtering == 'nearest' and not sampler.is_procedural(plane):
+            plane_rgb, plane_alpha = surface_rgb_alpha(plane)
+            colour, alpha = self.gather(plane_rgb, plane_alpha, cx, cy, angle)
+            del plane_rgb, plane_alpha
+        else:
+            colour, alpha = self.sample(sampler.sampler_for(plane), cx, cy,
+                                        filtering, angle)
+
+        layer_rgb = pygame.surfarray.pixels3d(layer)
+        layer_alpha = pygame.surfarray.pixels_alpha(layer)
+        layer_rgb[self.inside] = colour
+        layer_alpha[self.inside] = alpha
+        del layer_rgb, layer_alpha
+
         return layer
 
-    # otherwise, composite the layer with the existing surface
-    offset_x = sphere_surface.get_width() / 2 - radius
-    offset_y = sphere_surface.get_height() / 2 - radius
-    sphere_surface.blit(layer, (offset_x, offset_y),
-                        special_flags=pygame.BLEND_ALPHA_SDL2)
+    # for array_cache, which keeps them
+    _ARRAYS = ('inside', 'u_offset', 'v_offset', 'footprint', 'shade')
 
-    sys.stdout.write("\r")  # Clear the progress line
-    sys.stdout.flush()  # Ensure the progress line gets updated immediately
+
+# part of the name of every LUT, so that LUTs saved before the geometry (or
+# how it's stored) changed aren't loaded.  Bump it with any such change.
+SPHERE_LUT_VERSION = 2
+
+# Most recently used LUTs.  At radius 1200 each is about 80 MB.
+LUT_CACHE_SIZE = 4
+_lut_cache = array_cache.ArrayCache(SphereLUT, "sphere_lut",
+                                    SPHERE_LUT_VERSION, LUT_CACHE_SIZE)
+
+
+def sphere_lut_key(radius: float, cz: float, shadow_amount: float) -> str:
+    """ Names the LUT for a sphere, in memory and on disk. """
+    return _lut_cache.key(f"r{radius!r}", f"z{cz!r}",
+                          f"s{max(shadow_amount, 0)!r}")
+
+
+def sphere_lut(radius: float, cz: float, shadow_amount: float,
+               directory: Optional[str] = None) -> SphereLUT:
+    """ The SphereLUT for a sphere, from the in-memory cache, else from
+        directory (if given), else computed (and saved to directory). """
+    return _lut_cache.get(
+        sphere_lut_key(radius, cz, shadow_amount),
+        lambda: SphereLUT.compute(radius, cz, shadow_amount), directory)
+
+
+def _blend(rgb: numpy.ndarray, alpha: numpy.ndarray, at: numpy.ndarray,
+           src_rgb: numpy.ndarray, src_alpha: numpy.ndarray) -> None:
+    """ Blends the (n, 3) colours and (n,) alphas src over the pixels at of
+        the int arrays rgb and alpha, in place, with the integer arithmetic
+        of SDL 2's alpha blend that composite_layer's blit uses: an opaque
+        source pixel is copied, a clear one changes nothing, and otherwise
+        each term is weighted by alpha and shifted down 8 bits. """
+    a = src_alpha.astype(numpy.int32)
+    keep = 255 - a
+    src_rgb = src_rgb.astype(numpy.int32)
+    new_rgb = ((src_rgb * a[:, numpy.newaxis]) >> 8) + \
+        ((rgb[at] * keep[:, numpy.newaxis]) >> 8)
+    new_alpha = a + ((alpha[at] * keep) >> 8)
+    opaque = a == 255
+    new_rgb[opaque] = src_rgb[opaque]
+    new_alpha[opaque] = 255
+    blended = a > 0
+    rgb[at[blended]] = new_rgb[blended]
+    alpha[at[blended]] = new_alpha[blended]
+
+
+def sphere_window(plane_size: Tuple[int, int], radius: float,
+                  centre_xy: Tuple[float, float], centre_z: float
+                  ) -> Tuple[int, int, int, int]:
+    """ (x0, y0, width, height) of the part of the plane a sphere samples
+        with nearest filtering: the pixels within radius + centre_z of the
+        point under its centre.  Along an axis where that would cross the
+        edge of the plane (where the sampling wraps), it's the whole plane. """
+    reach = radius + centre_z
+    window = []
+    for centre, size in zip(centre_xy, plane_size):
+        low = math.floor(centre - reach + 0.5)
+        high = math.floor(centre + reach + 0.5) + 1
+        if low < 0 or high > size:
+            low, high = 0, size
+        window.append((low, high - low))
+    (x0, width), (y0, height) = window
+    return x0, y0, width, height
+
+
+def shell_plane(plane, radius: float, centre_xy: Tuple[float, float],
+                centre_z: float) -> Tuple[object, Tuple[float, float]]:
+    """ (plane, centre) for one sphere to sample with nearest filtering.  A
+        plane that can draw a region of itself (like
+        hextiles.ProceduralHexPlane) is drawn in just its sphere_window, and
+        the centre moved to match; any other plane is used as it is. """
+    if not hasattr(plane, 'region'):
+        return plane, centre_xy
+    x0, y0, width, height = sphere_window(plane.get_size(), radius,
+                                          centre_xy, centre_z)
+    return (plane.region(x0, y0, width, height),
+            (centre_xy[0] - x0, centre_xy[1] - y0))
+
+
+def project_image_to_nested_spheres(
+        sphere_surface: pygame.Surface,
+        plane: pygame.Surface,
+        shells: List[Tuple[float, float, Tuple[float, float], float]],
+        filtering: str = 'nearest',
+        band_height: int = 256) -> pygame.Surface:
+    """ Wrap the plane around several concentric spheres and composite them
+        over sphere_surface, as calling project_image_to_sphere for each shell
+        in turn would, but in one pass without making a layer for each shell.
+    shells are (radius, shadow_amount, sphere_centre_xy, sphere_centre_z),
+        from the innermost (furthest back) out.
+    The shells are sampled front to back, from the outer shell in, and
+        shells behind a pixel are not looked at once a shell is opaque there.
+        They're then blended back to front as the blits would (see _blend),
+        so the result is the same as the shell by shell blits.
+    sphere_surface must have per-pixel alpha (e.g. be made with
+        pygame.SRCALPHA).  It's drawn on and returned.  The work is done in
+        bands of band_height rows, to keep the temporary arrays small.
+    """
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
+    # procedural planes are sampled, even for nearest
+    gather = filtering == 'nearest' and not sampler.is_procedural(plane)
+    if gather:
+        plane_rgb, plane_alpha = surface_rgb_alpha(plane)
+    else:
+        plane_sampler = sampler.sampler_for(plane)
+
+    surface_width, surface_height = sphere_surface.get_size()
+    out_rgb = pygame.surfarray.pixels3d(sphere_surface)
+    out_alpha = pygame.surfarray.pixels_alpha(sphere_surface)
+
+    for y0 in range(0, surface_height, band_height):
+        y1 = min(y0 + band_height, surface_height)
+        sys.stdout.write(
+            f"\rNested spheres Progress: {y1 / surface_height * 100:.0f}%")
+        sys.stdout.flush()
+
+        xs, ys = numpy.meshgrid(numpy.arange(surface_width),
+                                numpy.arange(y0, y1), indexing='ij')
+        xs, ys = xs.ravel(), ys.ravel()
+        # (pixels, colours, alphas) of each shell, from the outer shell in
+        samples = []
+        opaque = numpy.zeros(len(xs), dtype=bool)
+        active = numpy.arange(len(xs))
+
+        for radius, shadow_amount, (cx, cy), cz in reversed(shells):
+            # where project_image_to_sphere would blit this shell's layer
+            size = int(ceiling(2 * radius))
+            offset_x = int(surface_width / 2 - radius)
+            offset_y = int(surface_height / 2 - radius)
+            lx = xs[active] - offset_x
+            ly = ys[active] - offset_y
+            dx = lx - radius
+            dy = ly - radius
+            hit = ((dx * dx + dy * dy <= radius * radius) &
+                   (lx >= 0) & (lx < size) & (ly >= 1) & (ly < size))
+            at = active[hit]
+            if len(at) == 0:
+                continue
+
+            u_offset, v_offset, footprint, shade = _sphere_geometry(
+                dx[hit].astype(numpy.float64), dy[hit].astype(numpy.float64),
+                radius, cz, shadow_amount)
+            if gather:
+                shell_rgb, shell_alpha = _shaded_nearest(
+                    plane_rgb, plane_alpha, cx + u_offset, cy + v_offset,
+                    shade)
+            else:
+                shell_rgb, shell_alpha = _shaded_filtered(
+                    plane_sampler, cx + u_offset, cy + v_offset, filtering,
+                    footprint, shade)
+
+            samples.append((at, shell_rgb, shell_alpha))
+            # an opaque pixel is copied over whatever is behind it
+            opaque[at[shell_alpha == 255]] = True
+            active = active[~opaque[active]]
+            if len(active) == 0:
+                break
+
+        # blended over whatever was on the surface, from the inner shell out
+        band_rgb = out_rgb[:, y0:y1].reshape(-1, 3).astype(numpy.int32)
+        band_alpha = out_alpha[:, y0:y1].ravel().astype(numpy.int32)
+        for at, shell_rgb, shell_alpha in reversed(samples):
+            _blend(band_rgb, band_alpha, at, shell_rgb, shell_alpha)
+        out_rgb[:, y0:y1] = band_rgb.astype(numpy.uint8).reshape(
+            surface_width, y1 - y0, 3)
+        out_alpha[:, y0:y1] = band_alpha.astype(numpy.uint8).reshape(
+            surface_width, y1 - y0)
+
+    del out_rgb, out_alpha
+    if gather:
+        del plane_rgb, plane_alpha
+    sys.stdout.write("\r")
+    sys.stdout.flush()
     return sphere_surface
 
 
+def sphere_frames(
+        plane: pygame.Surface,
+        radius: float,
+        path: Iterable[Tuple[float, ...]],
+        shadow_amount: float = 0.3,
+        sphere_centre_z: Optional[float] = None,
+        filtering: str = 'nearest',
+        lut_directory: Optional[str] = None) -> Iterator[pygame.Surface]:
+    """ Projected layers of the plane on one sphere, one per entry of path,
+        which is (cx, cy) or (cx, cy, angle) for the sphere centre above the
+        plane and the turn of the plane (radians) about it.  The geometry and
+        shading are worked out once; each frame is just a gather.  Layers are
+        made as they are asked for, so a long path doesn't use more memory.
+    """
+    cz = radius if sphere_centre_z is None else sphere_centre_z
+    lut = sphere_lut(radius, cz, shadow_amount, lut_directory)
+    for centre in path:
+        yield lut.render(plane, centre[0], centre[1], filtering,
+                         centre[2] if len(centre) > 2 else 0.0)
+
+
+def _sphere_pixels(plane: pygame.Surface, x: numpy.ndarray, y: numpy.ndarray,
+                   radius: float, shadow_amount: float,
+                   cx: float, cy: float, cz: float, filtering: str
+                   ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray,
+                              numpy.ndarray]:
+    """ (x, y, colours, alphas) for those of the layer pixels (x, y) (1d
+        arrays) that are inside the sphere, as the numpy engine makes them.
+        The plane is read afresh, and let go before returning, so it isn't
+        left locked. """
+    # as SphereLUT.compute, for just these pixels
+    dx = x.astype(numpy.float64) - radius
+    dy = y.astype(numpy.float64) - radius
+    inside = (dx * dx + dy * dy <= radius * radius) & (y != 0)
+    u_offset, v_offset, footprint, shade = _sphere_geometry(
+        dx[inside], dy[inside], radius, cz, shadow_amount)
+    if filtering == 'nearest' and not sampler.is_procedural(plane):
+        plane_rgb, plane_alpha = surface_rgb_alpha(plane)
+        colour, alpha = _shaded_nearest(plane_rgb, plane_alpha,
+                                        cx + u_offset, cy + v_offset, shade)
+        del plane_rgb, plane_alpha
+    else:
+        plane_sampler = sampler.sampler_for(plane)
+        colour, alpha = _shaded_filtered(plane_sampler, cx + u_offset,
+                                         cy + v_offset, filtering, footprint,
+                                         shade)
+        del plane_sampler
+    return x[inside], y[inside], colour, alpha
+
+
+def progressive_sphere(
+        plane: pygame.Surface,
+        radius: float,
+        shadow_amount: float = 0.3,
+        sphere_centre_xy: Optional[Tuple[float, float]] = None,
+        sphere_centre_z: Optional[float] = None,
+        filtering: str = 'nearest',
+        stride: int = progressive.PREVIEW_STRIDE) -> Iterator[pygame.Surface]:
+    """ The layer project_image_to_sphere makes, coarse to fine: yields a
+        blocky preview from every stride'th pixel first, then sharper ones
+        as the gaps are rendered (see progressive.py).  The last layer is
+        the same as the numpy engine's, and costs about as much in all.
+        The plane is read as it is at each pass, without copying it, and
+        isn't locked between passes.  With trilinear filtering its mip pyramid
+        is kept for later passes and calls, and made again if the plane has
+        been drawn on since (see sampler.sampler_for);
+        sampler.forget_sampler(plane) frees it.
+    """
+    width, height = plane.get_size()
+    cx, cy = (width / 2, height / 2) \
+        if (sphere_centre_xy is None) \
+        else sphere_centre_xy
+    cz = radius if sphere_centre_z is None else sphere_centre_z
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
+
+    size = int(ceiling(2 * radius))
+    layer_rgba = numpy.zeros((size, size, 4), dtype=numpy.uint8)
+    for pass_stride, x, y in progressive.pass_pixels((size, size), stride):
+        x, y, colour, alpha = _sphere_pixels(plane, x, y, radius,
+                                             shadow_amount, cx, cy, cz,
+                                             filtering)
+        layer_rgba[x, y, :3] = colour
+        layer_rgba[x, y, 3] = alpha
+
+        preview = progressive.fill_in(layer_rgba, pass_stride)
+        layer = pygame.Surface((size, size), pygame.SRCALPHA)
+        pygame.surfarray.pixels3d(layer)[:] = preview[..., :3]
+        pygame.surfarray.pixels_alpha(layer)[:] = preview[..., 3]
+        yield layer
+
+
+def sphere_in_time(
+        seconds: float,
+        plane: pygame.Surface,
+        radius: float,
+        shadow_amount: float = 0.3,
+        sphere_centre_xy: Optional[Tuple[float, float]] = None,
+        sphere_centre_z: Optional[float] = None,
+        filtering: str = 'nearest') -> Tuple[pygame.Surface, dict]:
+    """ The best layer project_image_to_sphere can make in about seconds.
+        For trilinear filtering the plane's mip pyramid is built first, if it
+        hasn't been already, and that counts against seconds.  A few pixels
+        are timed, and from that rate the first pass of progressive_sphere is
+        made coarse enough to take at most a quarter of the time left (see
+        progressive.first_stride); then it runs for as many passes as will
+        fit.  The first pass always runs, so if the setup and that pass take
+        longer than seconds, so does this.  Returns the layer and a dict of
+          stride    1 if the layer is finished, else the spacing of the
+                    pixels that were rendered (the rest are filled in)
+          seconds   how long it took
+    """
+    started = time.perf_counter()
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
+    # one-off costs, which mustn't be mistaken for the rate
+    if filtering == 'trilinear':
+        sampler.sampler_for(plane).build_pyramid()
+
+    # pixels a second, from a sparse grid of them
+    width, height = plane.get_size()
+    cx, cy = (width / 2, height / 2) \
+        if (sphere_centre_xy is None) \
+        else sphere_centre_xy
+    cz = radius if sphere_centre_z is None else sphere_centre_z
+    size = int(ceiling(2 * radius))
+    _, x, y = next(progressive.pass_pixels((size, size), 32))
+    start = time.perf_counter()
+    _sphere_pixels(plane, x, y, radius, shadow_amount, cx, cy, cz, filtering)
+    rate = len(x) / max(time.perf_counter() - start, 1e-6)
+
+    stride = progressive.first_stride(
+        (size, size), rate, seconds - (time.perf_counter() - started))
+    layer, stride = progressive.within(
+        progressive_sphere(plane, radius, shadow_amount, sphere_centre_xy,
+                           sphere_centre_z, filtering, stride),
+        (size, size), stride, seconds, started)
+    return layer, dict(stride=stride,
+                       seconds=time.perf_counter() - started)
+
+
+def _render_band(plane_reference, plane_size: Tuple[int, int],
+                 layer_name: str, size: int, radius: float, cz: float,
+                 shadow_amount: float, cx: float, cy: float,
+                 rows: Tuple[int, int], filtering: str) -> int:
+    """ Worker for _project_layer_banded: renders rows (y0, y1) of the layer
+        straight into its shared memory.  Returns the number of rows. """
+    plane_memory, plane_sampler = sampler.open_plane(plane_reference,
+                                                     plane_size)
+    layer_memory = shared_memory.SharedMemory(name=layer_name)
+    try:
+        layer_rgba = numpy.ndarray((size, size, 4), dtype=numpy.uint8,
+                                   buffer=layer_memory.buf)
+
+        lut = SphereLUT.compute(radius, cz, shadow_amount, rows)
+        if filtering == 'nearest' and plane_memory is not None:
+            colour, alpha = lut.gather(*plane_sampler.levels[0], cx, cy)
+        else:
+            colour, alpha = lut.sample(plane_sampler, cx, cy, filtering)
+        band = layer_rgba[:, rows[0]:rows[1]]
+        band[..., :3][lut.inside] = colour
+        band[..., 3][lut.inside] = alpha
+        # the arrays must go before the shared memory can be closed
+        del plane_sampler, layer_rgba, band
+    finally:
+        if plane_memory is not None:
+            plane_memory.close()
+        layer_memory.close()
+    return rows[1] - rows[0]
+
+
+def _project_layer_banded(plane: pygame.Surface, radius: float,
+                          shadow_amount: float,
+                          cx: float, cy: float, cz: float,
+                          workers: int, filtering: str) -> pygame.Surface:
+    """ The numpy engine, rendered in horizontal bands by a pool of worker
+        processes.  The plane, with its mip pyramid for trilinear filtering,
+        is copied once into shared memory rather than being pickled for each
+        band (unless it's procedural, and small). """
+    width, height = plane.get_size()
+    size = int(ceiling(2 * radius))
+
+    plane_memory = sampler.share_plane(plane, filtering == 'trilinear')
+    layer_memory = shared_memory.SharedMemory(create=True,
+                                              size=max(size * size * 4, 1))
+    try:
+        layer_rgba = numpy.ndarray((size, size, 4), dtype=numpy.uint8,
+                                   buffer=layer_memory.buf)
+        layer_rgba[:] = 0
+
+        edges = numpy.linspace(0, size,
+                               workers * sampler.CHUNKS_PER_WORKER + 1)
+        edges = [round(e) for e in edges]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_render_band,
+                            sampler.plane_reference(plane, plane_memory),
+                            (width, height),
+                            layer_memory.name, size, radius, cz,
+                            shadow_amount, cx, cy, (y0, y1), filtering)
+                for y0, y1 in zip(edges[:-1], edges[1:]) if y1 > y0]
+            done = 0
+            for future in as_completed(futures):
+                done += future.result()
+                progress = done / size * 100
+                sys.stdout.write(f"\rSphere wrapping Progress: {progress:.0f}%")
+                sys.stdout.flush()
+
+        layer = pygame.Surface((size, size), pygame.SRCALPHA)
+        layer_rgb = pygame.surfarray.pixels3d(layer)
+        layer_alpha = pygame.surfarray.pixels_alpha(layer)
+        layer_rgb[:] = layer_rgba[..., :3]
+        layer_alpha[:] = layer_rgba[..., 3]
+        del layer_rgb, layer_alpha, layer_rgba
+    finally:
+        sampler.release_plane(plane_memory)
+        layer_memory.close()
+        layer_memory.unlink()
+
+    return layer
+
+
+def _render_shell(plane_reference, plane_size: Tuple[int, int],
+                  radius: float, shadow_amount: float,
+                  centre_xy: Tuple[float, float], cz: float,
+                  lut_directory: Optional[str]) -> numpy.ndarray:
+    """ Worker for project_shells: one shell's layer, as a (size, size, 4)
+        RGBA array. """
+    plane_memory, plane_sampler = sampler.open_plane(plane_reference,
+                                                     plane_size)
+    try:
+        lut = sphere_lut(radius, cz, shadow_amount, lut_directory)
+        if plane_memory is not None:
+            colour, alpha = lut.gather(*plane_sampler.levels[0], *centre_xy)
+        else:
+            # just the part of a procedural plane this shell needs
+            window, centre_xy = shell_plane(plane_sampler, radius, centre_xy,
+                                            cz)
+            if sampler.is_procedural(window):
+                colour, alpha = lut.sample(window, *centre_xy, 'nearest')
+            else:
+                colour, alpha = lut.gather(*surface_rgb_alpha(window),
+                                           *centre_xy)
+            del window
+        del plane_sampler
+    finally:
+        if plane_memory is not None:
+            plane_memory.close()
+
+    layer_rgba = numpy.zeros((lut.size, lut.size, 4), dtype=numpy.uint8)
+    layer_rgba[..., :3][lut.inside] = colour
+    layer_rgba[..., 3][lut.inside] = alpha
+    return layer_rgba
+
+
+def project_shells(
+        plane: pygame.Surface,
+        shells: List[Tuple[float, float, Tuple[float, float], float]],
+        workers: int,
+        lut_directory: Optional[str] = None) -> Iterator[pygame.Surface]:
+    """ The projected layer of each shell, as project_image_to_sphere would
+        make it, rendered concurrently by a pool of worker processes.
+    shells are (radius, shadow_amount, sphere_centre_xy, sphere_centre_z).
+        The layers are yielded in the same order, each as soon as it and all
+        the ones before it are done, so they can be composited while the rest
+        are still rendering.
+    The plane is shared with the workers rather than pickled for each shell
+        (unless it's procedural).
+    """
+    plane_memory = sampler.share_plane(plane)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_render_shell,
+                            sampler.plane_reference(plane, plane_memory),
+                            plane.get_size(),
+                            radius, shadow_amount, centre_xy, cz, lut_directory)
+                for radius, shadow_amount, centre_xy, cz in shells]
+            for future in futures:
+                layer_rgba = future.result()
+                layer = pygame.Surface(layer_rgba.shape[:2], pygame.SRCALPHA)
+                pygame.surfarray.pixels3d(layer)[:] = layer_rgba[..., :3]
+                pygame.surfarray.pixels_alpha(layer)[:] = layer_rgba[..., 3]
+                del layer_rgba
+                yield layer
+    finally:
+        sampler.release_plane(plane_memory)
+
+
 # Usage example
 if __name__ == "__main__":
     def main():
@@ -1,13 +1,21 @@
+import os
 import random
 import sys
 import math
-from typing import Optional, Tuple
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List, Optional, Tuple
 
 import pygame
 from pygame.math import clamp
 from sympy import ceiling
 import numpy
 
+import array_cache
+import progressive
+import sampler
+
 
 def rotate_x(theta: float) -> numpy.ndarray:
     """ 4x4 matrix for rotating around the x-axis by theta radians."""
@@ -37,12 +45,35 @@ def NDC_to_raster_matrix(width: int, height: int) -> numpy.ndarray:
     ], dtype=numpy.float32)
 
 
+def torus_geometry(plane_size: Tuple[int, int]
+                   ) -> Tuple[float, float, numpy.ndarray]:
+    """ (rw, rh, camera_matrix) of the torus a plane of this size wraps. """
+    # input plane (u, v)
+    uv_width, uv_height = plane_size
+
+    # torus (in model space, x,y,z)
+    # rw is the radius of the wheel, rh the radius of the tube
+    rw = (uv_width - 1) / (2 * math.pi)
+    rh = (uv_height - 1) / (2 * math.pi)
+
+    camera_matrix = translate(0, 0, z=(rh + rw) * 1.5) @ rotate_x(
+        math.radians(50))
+    return rw, rh, camera_matrix
+
+
 def project_image_to_torus(
         output_size: Tuple[int, int],
         plane: pygame.Surface,
         shadow_amount: float = 0.6,
         parallel_light: (float, float, float) = (-1, -1, 1),
-        shading_model: str = 'halflambertian'
+        shading_model: str = 'halflambertian',
+        filtering: str = 'nearest',
+        engine: str = 'python',
+        subsamples: int = 1,
+        map_directory: Optional[str] = None,
+        workers: int = 1,
+        checkpoint: Optional[str] = None,
+        resume: bool = False
 ) -> pygame.Surface:
     """ Given an image on a surface, wrap it around a torus and project that
         onto an output plane (in a way yet to be determined)
@@ -50,21 +81,130 @@ def project_image_to_torus(
         We assume that the light comes from a parallel source, parallel to the
         vector given in model (world) space.
         shading_model can be 'halflambertian', 'lambertian' or 'simple'
+        filtering is how the plane is sampled: 'nearest' (the default),
+        'bilinear' or 'trilinear', which picks a level of a mip pyramid of the
+        plane from how much of the plane each output pixel covers, so the far
+        side and the silhouette don't alias.  See sampler.py.
+        engine is one of
+          'python'  (the default) forward-maps every (theta, phi) sample onto
+                    the output, one at a time.
+          'splat'   does the same in batches with NumPy, with a float depth
+                    buffer, back faces culled (for opaque planes) and only as
+                    many samples as the projection needs.
+          'raycast' casts subsamples**2 rays through each output pixel and
+                    intersects them with the torus, so every pixel gets
+                    exactly that many samples.  Partly transparent texels
+                    are blended properly with whatever is behind them on the
+                    ray.  Each band of rays is made into a G-buffer and shaded
+                    as relight does (see torus_gbuffer), so the two agree.
+          'map'     draws what 'raycast' does with one ray per pixel, using a
+                    TorusMap of where each ray crosses the torus.  That only
+                    depends on the output size and the plane size, so it's
+                    kept and reused for other planes.  If map_directory is
+                    given, maps are saved there too, for later runs.
+        The plane's mip pyramid is kept for later calls, and made again if
+        the plane has been drawn on since (see sampler.sampler_for).
+        subsamples is only for the 'raycast' engine, and workers > 1 only for
+        'splat' and 'raycast'; other engines raise ValueError for them.
+        workers > 1 renders the 'splat' and 'raycast' engines in that many
+        processes: 'raycast' in tiles of output rows, and 'splat' in ranges of
+        theta whose depth buffers are merged.  The image is the same as with
+        one process.
+        checkpoint is a file for the 'python' engine to save its progress in
+        every minute or so; with resume=True a render that was interrupted
+        carries on from it, and finishes with the same image.
+        plane can also be procedural (see hextiles.ProceduralHexPlane), made
+        just where the torus samples it; make it toroidal to hide the seams.
     """
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
 
-    # input plane (u, v)
-    uv_width, uv_height = plane.get_size()
-
-    # torus (in model space, x,y,z)
-    # rw is the radius of the wheel, rh the radius of the tube
-    rw = (uv_width - 1) / (2 * math.pi)
-    rh = (uv_height - 1) / (2 * math.pi)
+    rw, rh, camera_matrix = torus_geometry(plane.get_size())
 
     parallel_light = numpy.array(parallel_light, dtype=numpy.float32)
     parallel_light /= numpy.linalg.norm(parallel_light)
 
-    camera_matrix = translate(0, 0, z=(rh + rw) * 1.5) @ rotate_x(
-        math.radians(50))
+    if checkpoint is not None and engine != 'python':
+        raise ValueError(f"The '{engine}' engine doesn't keep checkpoints")
+    if workers > 1 and engine not in ('splat', 'raycast'):
+        raise ValueError("workers > 1 needs the 'splat' or 'raycast' engine")
+    if subsamples != 1 and engine != 'raycast':
+        raise ValueError("subsamples needs the 'raycast' engine")
+
+    if engine == 'python':
+        return _torus_layer_python(output_size, plane, rw, rh, camera_matrix,
+                                   parallel_light, shadow_amount,
+                                   shading_model, filtering, checkpoint,
+                                   resume)
+    elif engine == 'splat':
+        return _torus_layer_splat(output_size, plane, rw, rh, camera_matrix,
+                                  parallel_light, shadow_amount,
+                                  shading_model, filtering, workers=workers)
+    elif engine == 'map':
+        return torus_map(output_size, plane.get_size(), map_directory).render(
+            plane, shadow_amount, parallel_light, shading_model, filtering)
+    elif engine == 'raycast':
+        return _torus_layer_raycast(output_size, plane, rw, rh, camera_matrix,
+                                    parallel_light, shadow_amount,
+                                    shading_model, filtering, subsamples,
+                                    workers=workers)
+    else:
+        raise ValueError(f"Unknown torus engine '{engine}'")
+
+
+def _checkpoint_key(output_size: Tuple[int, int], plane: pygame.Surface,
+                    *settings) -> str:
+    """ Identifies a render, so a checkpoint isn't resumed by a different one.
+        The plane's pixels (or what a procedural plane is made from) are part
+        of it. """
+    digest = hashlib.sha1(repr((tuple(output_size), plane.get_size(),
+                                settings)).encode())
+    if sampler.is_procedural(plane):
+        digest.update(plane.fingerprint())
+    else:
+        digest.update(pygame.image.tobytes(plane, "RGBA"))
+    return digest.hexdigest()
+
+
+def _save_checkpoint(path: str, key: str, next_theta: int,
+                     layer: pygame.Surface) -> None:
+    """ Writes the layer so far (depth and all) and the index of the next
+        theta to path, by way of a temporary file so that an interruption
+        never leaves half a checkpoint. """
+    with open(path + ".tmp", "wb") as f:
+        numpy.savez(f, key=key, next_theta=next_theta,
+                    rgb=pygame.surfarray.array3d(layer),
+                    alpha=pygame.surfarray.array_alpha(layer))
+    os.replace(path + ".tmp", path)
+
+
+def _load_checkpoint(path: str, key: str
+                     ) -> Optional[Tuple[int, numpy.ndarray, numpy.ndarray]]:
+    """ (next theta, rgb, alpha) from a checkpoint of this render, or None. """
+    if not os.path.exists(path):
+        return None
+    with numpy.load(path) as saved:
+        if str(saved['key']) != key:
+            print(f"{path} is a checkpoint of a different render, "
+                  f"starting again")
+            return None
+        return int(saved['next_theta']), saved['rgb'], saved['alpha']
+
+
+def _torus_layer_python(output_size: Tuple[int, int], plane: pygame.Surface,
+                        rw: float, rh: float, camera_matrix: numpy.ndarray,
+                        parallel_light: numpy.ndarray, shadow_amount: float,
+                        shading_model: str, filtering: str,
+                        checkpoint: Optional[str] = None,
+                        resume: bool = False,
+                        checkpoint_seconds: float = 60.0) -> pygame.Surface:
+    """ The original forward-mapping implementation of project_image_to_torus:
+        steps through (theta, phi) and splats each sample onto the output.
+        If checkpoint is a path, the partly drawn layer (whose alpha is the
+        depth buffer) and the next theta are saved there every
+        checkpoint_seconds.  With resume=True the render carries on from
+        there, giving exactly the image an uninterrupted run would.  The
+        checkpoint is removed once the render is finished. """
     render_matrix = NDC_to_raster_matrix(*output_size)
 
     # compute the relevant Z range in image space
@@ -86,26 +226,89 @@ def project_image_to_torus(
     layer.fill((255, 255, 255, 255))
 
     layer.unlock()
-    plane.unlock()
+    if not sampler.is_procedural(plane):
+        plane.unlock()
 
     # bigger is smoother, but takes longer, and repeats pixels.
-    # TODO: dynamically modify the sampling rate depending on the projection
-    #       (probably the derivative in the image space?)  We're aiming to get
-    #       one sample per pixel.
+    # (engine='splat' picks the sampling rate from the derivatives of the
+    # projection instead.)
     sampling = 4.5
 
-    for theta in numpy.linspace(0, 2 * math.pi,
-                                round(sampling * max(*output_size))):
+    phis = numpy.linspace(0, 2 * math.pi, round(sampling * max(*output_size)))
+    # filtered samples, and any of a procedural plane (which get_at would make
+    # a pixel at a time), are taken a row of phis at a time
+    by_row = filtering != 'nearest' or sampler.is_procedural(plane)
+    if by_row:
+        plane_sampler = sampler.sampler_for(plane)
+    if filtering != 'nearest':
+        def screen_xy(theta: float) -> numpy.ndarray:
+            """ (2, n) raster positions of the points at theta, phis """
+            l = rw + rh * numpy.cos(phis)
+            xyz1 = numpy.stack((l * math.cos(theta), l * math.sin(theta),
+                                rh * numpy.sin(phis), numpy.ones_like(l)))
+            X, Y, Z = (camera_matrix @ xyz1)[:3]
+            return numpy.stack((how + X * how / Z, hoh - Y * hoh / Z))
+
+    thetas = numpy.linspace(0, 2 * math.pi,
+                            round(sampling * max(*output_size)))
+    start = 0
+    if checkpoint is not None:
+        key = _checkpoint_key(output_size, plane, rw, rh,
+                              parallel_light.tolist(), shadow_amount,
+                              shading_model, filtering, sampling)
+        saved = _load_checkpoint(checkpoint, key) if resume else None
+        if saved is not None:
+            start, saved_rgb, saved_alpha = saved
+            layer_rgb = pygame.surfarray.pixels3d(layer)
+            layer_alpha = pygame.surfarray.pixels_alpha(layer)
+            layer_rgb[:] = saved_rgb
+            layer_alpha[:] = saved_alpha
+            del layer_rgb, layer_alpha, saved_rgb, saved_alpha
+            print(f"Resuming from theta {start} of {len(thetas)}")
+        last_saved = time.monotonic()
+
+    for i in range(start, len(thetas)):
+        if (checkpoint is not None and
+                time.monotonic() - last_saved >= checkpoint_seconds):
+            _save_checkpoint(checkpoint, key, i, layer)
+            last_saved = time.monotonic()
+
+        theta = thetas[i]
         progress = theta / (2 * math.pi) * 100  # Calculate progress percentage
         print(f"\rTorus wrapping: {progress:.0f}%", end="",
               flush=True)  # Overwrite the progress line
 
         stheta, ctheta = math.sin(theta), math.cos(theta)
         u = round(rw * theta)
-        for phi in numpy.linspace(0, 2 * math.pi,
-                                  round(sampling * max(*output_size))):
-            v = round(rh * phi)
-            pixel_colour = plane.get_at((u, v))
+
+        if filtering != 'nearest':
+            # plane pixels per output pixel, along theta and phi, from the
+            # raster distance moved by a small step in each
+            step = 1e-3
+            here = screen_xy(theta)
+            along_theta = numpy.linalg.norm(screen_xy(theta + step) - here,
+                                            axis=0) / step
+            along_phi = numpy.linalg.norm(numpy.gradient(here, phis, axis=1),
+                                          axis=0)
+            with numpy.errstate(divide='ignore'):
+                footprint = numpy.maximum(rw / along_theta, rh / along_phi)
+            colours, alphas = plane_sampler.sample(
+                numpy.full_like(phis, rw * theta), rh * phis, filtering,
+                footprint)
+        elif by_row:
+            # the pixels get_at would read
+            colours, alphas = plane_sampler.sample(
+                numpy.full_like(phis, u), numpy.round(rh * phis), filtering)
+        if by_row:
+            row_colours = [pygame.Color(*c) for c in numpy.round(
+                numpy.column_stack((colours, alphas))).astype(int).tolist()]
+
+        for j, phi in enumerate(phis):
+            if by_row:
+                pixel_colour = pygame.Color(row_colours[j])
+            else:
+                v = round(rh * phi)
+                pixel_colour = plane.get_at((u, v))
 
             # pixel is fully transparent
             if pixel_colour[3] == 0:
@@ -192,17 +395,971 @@ def project_image_to_torus(
 
         print("\r", end="", flush=True)  # Clear the progress line
 
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
     # convert Z field of each pixel back to solid colour
-    for i in range(output_size[0]):
-        for j in range(output_size[1]):
-            p = layer.get_at((i, j))
-            p.a = 255
-            layer.set_at((i, j), p)
+    layer_alpha = pygame.surfarray.pixels_alpha(layer)
+    layer_alpha[:] = 255
+    del layer_alpha
 
     layer.lock()
     return layer
 
 
+# in a worker process, the sampler for the plane it's rendering
+_worker_plane: dict = {}
+
+
+def _shared_sampler(plane_reference, plane_size: Tuple[int, int]
+                    ) -> sampler.PlaneSampler:
+    """ In a worker, a sampler for a sampler.plane_reference.  A shared plane's
+        is kept (and the shared memory left open) for the worker's later
+        tiles.  For trilinear filtering the mip pyramid comes with the plane
+        (see sampler.share_plane); a procedural plane's tiles build theirs
+        once in each process. """
+    if not isinstance(plane_reference, tuple):
+        return plane_reference
+    if plane_reference not in _worker_plane:
+        _worker_plane[plane_reference] = sampler.open_plane(plane_reference,
+                                                            plane_size)
+    return _worker_plane[plane_reference][1]
+
+
+def _torus_points(thetas: numpy.ndarray, phis: numpy.ndarray, rw: float,
+                  rh: float, camera_matrix: numpy.ndarray,
+                  how: float, hoh: float) -> dict:
+    """ Where the (theta, phi) grid of samples lands in the output, all as
+        (len(thetas), len(phis)) arrays:
+          sx, sy        raster position
+          Z             depth in camera space
+          normal        (..., 3) unit normal in model space
+          facing        whether the surface faces the camera
+          ds_dtheta, ds_dphi   raster distance moved per radian of theta and
+                        of phi
+    """
+    theta = thetas[:, numpy.newaxis]
+    phi = phis[numpy.newaxis, :]
+    ctheta, stheta = numpy.cos(theta), numpy.sin(theta)
+    cphi, sphi = numpy.cos(phi), numpy.sin(phi)
+    shape = (len(thetas), len(phis))
+
+    # position in model space, and its derivatives
+    l = rw + rh * cphi
+    model = numpy.stack(numpy.broadcast_arrays(l * ctheta, l * stheta,
+                                               rh * sphi), axis=-1)
+    dp_dtheta = numpy.stack(numpy.broadcast_arrays(-l * stheta, l * ctheta,
+                                                   numpy.zeros(shape)), axis=-1)
+    dp_dphi = numpy.stack(numpy.broadcast_arrays(-rh * sphi * ctheta,
+                                                 -rh * sphi * stheta,
+                                                 rh * cphi), axis=-1)
+    normal = numpy.stack(numpy.broadcast_arrays(ctheta * cphi, stheta * cphi,
+                                                sphi), axis=-1)
+
+    camera_matrix = camera_matrix.astype(numpy.float64)
+    rotation = camera_matrix[:3, :3]
+    camera = model @ rotation.T + camera_matrix[:3, 3]
+    X, Y, Z = camera[..., 0], camera[..., 1], camera[..., 2]
+
+    def raster_speed(dp):
+        dX, dY, dZ = (dp @ rotation.T).transpose(2, 0, 1)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            dsx = how * (dX * Z - X * dZ) / (Z * Z)
+            dsy = hoh * (dY * Z - Y * dZ) / (Z * Z)
+        return numpy.hypot(dsx, dsy)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sx = how + X * how / Z
+        sy = hoh - Y * hoh / Z
+    # the camera is at the origin of camera space, looking along +Z
+    facing = numpy.einsum('...i,...i->...', normal @ rotation.T, camera) < 0
+    return dict(sx=sx, sy=sy, Z=Z, normal=normal, facing=facing,
+                ds_dtheta=raster_speed(dp_dtheta),
+                ds_dphi=raster_speed(dp_dphi))
+
+
+def _nearest_per_pixel(pixel: numpy.ndarray, depth: numpy.ndarray
+                       ) -> numpy.ndarray:
+    """ Indices of the nearest sample for each distinct pixel. """
+    order = numpy.lexsort((depth, pixel))
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = pixel[order[1:]] != pixel[order[:-1]]
+    return order[first]
+
+
+def _merge_splats(depth_buffer: numpy.ndarray, colour_buffer: numpy.ndarray,
+                  splats: Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+                  ) -> None:
+    """ Writes (pixel, depth, colour) samples, at most one per pixel, into the
+        buffers where they are nearer than what's there. """
+    pixel, depth, colour = splats
+    closer = depth < depth_buffer[pixel]
+    pixel = pixel[closer]
+    depth_buffer[pixel] = depth[closer]
+    colour_buffer[pixel] = colour[closer]
+
+
+def _nearest_splats(splats: List[Tuple[numpy.ndarray, numpy.ndarray,
+                                       numpy.ndarray]]
+                    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """ The nearest of several lots of (pixel, depth, colour) samples in each
+        pixel.  Ties go to the earliest, as they would if the lots were merged
+        into a buffer one after another. """
+    pixel, depth, colour = [numpy.concatenate(a) for a in zip(*splats)]
+    nearest = _nearest_per_pixel(pixel, depth)
+    return pixel[nearest], depth[nearest], colour[nearest]
+
+
+def _splat_chunk(plane_sampler: sampler.PlaneSampler, chunk: numpy.ndarray,
+                 output_size: Tuple[int, int], rw: float, rh: float,
+                 camera_matrix: numpy.ndarray, parallel_light: numpy.ndarray,
+                 shadow_amount: float, shading_model: str, filtering: str,
+                 oversampling: float, cull: bool) -> Tuple[tuple, tuple]:
+    """ Splats the thetas in chunk, with as many phis as they need.  Returns
+        the nearest opaque sample in each pixel as (pixel, depth, rgb), and
+        the nearest partly transparent one as (pixel, depth, rgba), with
+        alpha in [0, 1]. """
+    output_width, output_height = output_size
+    how, hoh = output_width / 2, output_height / 2
+    nothing = (numpy.zeros(0, dtype=numpy.intp),
+               numpy.zeros(0, dtype=numpy.float32))
+    opaque = (*nothing, numpy.zeros((0, 3), dtype=numpy.float32))
+    glass = (*nothing, numpy.zeros((0, 4), dtype=numpy.float32))
+
+    # the phi rate this chunk of thetas needs
+    coarse = numpy.linspace(0, 2 * math.pi, 90, endpoint=False)
+    look = _torus_points(chunk[::4], coarse, rw, rh, camera_matrix, how, hoh)
+    in_front = look['Z'] > 0
+    speed = look['ds_dphi'][in_front].max() if in_front.any() else 1
+    num_phis = max(math.ceil(2 * math.pi * oversampling * speed), 1)
+    phis = numpy.linspace(0, 2 * math.pi, num_phis, endpoint=False)
+
+    points = _torus_points(chunk, phis, rw, rh, camera_matrix, how, hoh)
+    sx = numpy.rint(points['sx'])
+    sy = numpy.rint(points['sy'])
+    keep = ((points['Z'] > 0) & (sx >= 0) & (sx < output_width) &
+            (sy >= 0) & (sy < output_height))
+    if cull:
+        keep &= points['facing']
+    if not keep.any():
+        return opaque, glass
+
+    theta = numpy.broadcast_to(chunk[:, numpy.newaxis], keep.shape)[keep]
+    phi = numpy.broadcast_to(phis[numpy.newaxis, :], keep.shape)[keep]
+    footprint = None
+    if filtering == 'trilinear':
+        with numpy.errstate(divide='ignore'):
+            footprint = numpy.maximum(rw / points['ds_dtheta'][keep],
+                                      rh / points['ds_dphi'][keep])
+    rgb, alpha = plane_sampler.sample(rw * theta, rh * phi, filtering,
+                                      footprint)
+    rgb = shade_colours(rgb, points['normal'][keep], parallel_light,
+                        shadow_amount, shading_model)
+    pixel = (sx[keep] * output_height + sy[keep]).astype(numpy.intp)
+    depth = points['Z'][keep].astype(numpy.float32)
+
+    selected = alpha >= 255
+    if selected.any():
+        nearest = numpy.nonzero(selected)[0][_nearest_per_pixel(
+            pixel[selected], depth[selected])]
+        opaque = (pixel[nearest], depth[nearest],
+                  rgb[nearest].astype(numpy.float32))
+    selected = (alpha > 0) & (alpha < 255)
+    if selected.any():
+        nearest = numpy.nonzero(selected)[0][_nearest_per_pixel(
+            pixel[selected], depth[selected])]
+        rgba = numpy.empty((len(nearest), 4), dtype=numpy.float32)
+        rgba[:, :3] = rgb[nearest]
+        rgba[:, 3] = alpha[nearest] / 255
+        glass = (pixel[nearest], depth[nearest], rgba)
+    return opaque, glass
+
+
+def _splat_thetas(plane_reference, plane_size: Tuple[int, int],
+                  thetas: numpy.ndarray, chunk_thetas: int,
+                  output_size: Tuple[int, int], parallel_light: numpy.ndarray,
+                  shadow_amount: float, shading_model: str, filtering: str,
+                  oversampling: float, cull: bool) -> Tuple[tuple, tuple]:
+    """ Worker for _torus_layer_splat: splats thetas in chunks, and returns
+        the nearest opaque and partly transparent samples in each pixel, as
+        _splat_chunk does.  Only the pixels these thetas reach are kept, so
+        the memory used doesn't grow with the output. """
+    rw, rh, camera_matrix = torus_geometry(plane_size)
+    plane_sampler = _shared_sampler(plane_reference, plane_size)
+    opaque, glass = zip(*[
+        _splat_chunk(plane_sampler, thetas[start:start + chunk_thetas],
+                     output_size, rw, rh, camera_matrix, parallel_light,
+                     shadow_amount, shading_model, filtering, oversampling,
+                     cull)
+        for start in range(0, len(thetas), chunk_thetas)])
+    return _nearest_splats(opaque), _nearest_splats(glass)
+
+
+def _torus_layer_splat(output_size: Tuple[int, int], plane: pygame.Surface,
+                       rw: float, rh: float, camera_matrix: numpy.ndarray,
+                       parallel_light: numpy.ndarray, shadow_amount: float,
+                       shading_model: str, filtering: str,
+                       oversampling: float = 1.5,
+                       chunk_thetas: int = 64,
+                       workers: int = 1) -> pygame.Surface:
+    """ Batched forward-mapping implementation of project_image_to_torus.
+        The number of theta samples, and of phi samples for each chunk of
+        thetas, comes from the largest raster distance a sample step can
+        move, so that neighbouring samples land at most 1 / oversampling
+        pixels apart.  Visibility is resolved with a float depth buffer.
+        The nearest opaque sample wins each pixel, and the nearest partly
+        transparent one in front of it is blended over it.  Back faces are
+        culled unless the plane has transparent pixels they could show
+        through.
+        With workers > 1 the thetas are shared out between worker processes,
+        which send back the nearest samples they found in each pixel; these
+        are merged into the depth buffer in theta order, so the image is the
+        same as with one.
+    """
+    output_width, output_height = output_size
+    how, hoh = output_width / 2, output_height / 2
+    plane_sampler = sampler.sampler_for(plane)
+    cull = plane_sampler.opaque
+
+    # depth and colour of the nearest opaque, and nearest partly transparent,
+    # sample in each pixel (flattened as x * height + y, like surfarray)
+    num_pixels = output_width * output_height
+    opaque_depth = numpy.full(num_pixels, numpy.inf, dtype=numpy.float32)
+    opaque_rgb = numpy.full((num_pixels, 3), 255, dtype=numpy.float32)
+    glass_depth = numpy.full(num_pixels, numpy.inf, dtype=numpy.float32)
+    glass_rgba = numpy.zeros((num_pixels, 4), dtype=numpy.float32)
+
+    # the theta rate, from a coarse look at the projection
+    coarse = numpy.linspace(0, 2 * math.pi, 90, endpoint=False)
+    look = _torus_points(coarse, coarse, rw, rh, camera_matrix, how, hoh)
+    in_front = look['Z'] > 0
+    num_thetas = math.ceil(2 * math.pi * oversampling *
+                           look['ds_dtheta'][in_front].max())
+    thetas = numpy.linspace(0, 2 * math.pi, num_thetas, endpoint=False)
+
+    def merge(opaque, glass):
+        _merge_splats(opaque_depth, opaque_rgb, opaque)
+        _merge_splats(glass_depth, glass_rgba, glass)
+
+    if workers > 1:
+        # whole chunks for each task, so the samples match
+        num_chunks = math.ceil(num_thetas / chunk_thetas)
+        edges = numpy.linspace(0, num_chunks,
+                               workers * sampler.CHUNKS_PER_WORKER + 1)
+        edges = sorted({round(e) * chunk_thetas for e in edges})
+        plane_memory = sampler.share_plane(plane,
+                                           filtering == 'trilinear')
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(_splat_thetas,
+                                sampler.plane_reference(plane, plane_memory),
+                                plane.get_size(), thetas[start:end],
+                                chunk_thetas, output_size, parallel_light,
+                                shadow_amount, shading_model, filtering,
+                                oversampling, cull)
+                    for start, end in zip(edges[:-1], edges[1:])]
+                for start, future in zip(edges, futures):
+                    print(f"\rTorus splatting: {start / num_thetas * 100:.0f}%",
+                          end="", flush=True)
+                    merge(*future.result())
+        finally:
+            sampler.release_plane(plane_memory)
+    else:
+        for start in range(0, num_thetas, chunk_thetas):
+            print(f"\rTorus splatting: {start / num_thetas * 100:.0f}%", end="",
+                  flush=True)
+            merge(*_splat_chunk(plane_sampler,
+                                thetas[start:start + chunk_thetas],
+                                output_size, rw, rh, camera_matrix,
+                                parallel_light, shadow_amount, shading_model,
+                                filtering, oversampling, cull))
+
+    # blend the nearest partly transparent sample over the opaque one
+    over = glass_depth < opaque_depth
+    opaque_rgb[over] += (glass_rgba[over, :3] - opaque_rgb[over]) * \
+        glass_rgba[over, 3:]
+    print("\r", end="", flush=True)  # Clear the progress line
+
+    layer = pygame.Surface(size=output_size, flags=pygame.SRCALPHA)
+    layer.fill((255, 255, 255, 255))
+    layer_rgb = pygame.surfarray.pixels3d(layer)
+    layer_rgb[:] = numpy.round(numpy.clip(opaque_rgb, 0, 255)).astype(
+        numpy.uint8).reshape(output_width, output_height, 3)
+    del layer_rgb
+    return layer
+
+
+def shade_colours(colour: numpy.ndarray, normal: numpy.ndarray,
+                  parallel_light: numpy.ndarray, shadow_amount: float,
+                  shading_model: str) -> numpy.ndarray:
+    """ (n, 3) float colours shaded as the per-sample loop does, for the (n, 3)
+        unit normals in model space. """
+    light_dot_normal = normal @ parallel_light.astype(numpy.float64)
+    if shading_model == 'simple':
+        shade = (light_dot_normal * shadow_amount)[:, numpy.newaxis]
+        return numpy.where(shade > 0, colour * (1 - shade),
+                           colour + (255 - colour) * -shade)
+    elif shading_model == 'halflambertian':
+        light = (0.5 - 0.5 * light_dot_normal)[:, numpy.newaxis]
+        return colour * light
+    return colour
+
+
+def torus_intersections(origin: numpy.ndarray, directions: numpy.ndarray,
+                        rw: float, rh: float,
+                        chunk: int = 65536) -> numpy.ndarray:
+    """ Distances along rays to where they cross the torus (in model space,
+        around the z axis), as an (n, 4) array sorted nearest first and padded
+        with inf.  The rays start at origin and go along the (n, 3) unit
+        directions.
+        Each ray gives a quartic in the distance t,
+            (|p|^2 + rw^2 - rh^2)^2 = 4 rw^2 (x^2 + y^2)   with p = o + t d
+        whose real roots are found as eigenvalues of its companion matrix, then
+        polished with a couple of Newton steps.
+    """
+    # work in units of the torus' outer radius, to keep the powers tame
+    scale = rw + rh
+    o = numpy.asarray(origin, dtype=numpy.float64) / scale
+    d = numpy.asarray(directions, dtype=numpy.float64)
+    big_r2 = (rw / scale) ** 2
+    small_r2 = (rh / scale) ** 2
+
+    f = d @ o
+    g = o @ o + big_r2 - small_r2
+    c3 = 4 * f
+    c2 = 4 * f * f + 2 * g - 4 * big_r2 * (d[:, 0] ** 2 + d[:, 1] ** 2)
+    c1 = 4 * f * g - 8 * big_r2 * (o[0] * d[:, 0] + o[1] * d[:, 1])
+    c0 = g * g - 4 * big_r2 * (o[0] ** 2 + o[1] ** 2)
+
+    hits = numpy.full((len(d), 4), numpy.inf)
+    # only rays through the bounding sphere can hit
+    candidates = numpy.nonzero(f * f - (o @ o - 1) >= 0)[0]
+    for start in range(0, len(candidates), chunk):
+        rays = candidates[start:start + chunk]
+        companion = numpy.zeros((len(rays), 4, 4))
+        companion[:, 0, 0] = -c3[rays]
+        companion[:, 0, 1] = -c2[rays]
+        companion[:, 0, 2] = -c1[rays]
+        companion[:, 0, 3] = -c0
+        companion[:, 1, 0] = companion[:, 2, 1] = companion[:, 3, 2] = 1
+        roots = numpy.linalg.eigvals(companion)
+
+        t = roots.real
+        for _ in range(2):
+            p = (((t + c3[rays, None]) * t + c2[rays, None]) * t
+                 + c1[rays, None]) * t + c0
+            dp = ((4 * t + 3 * c3[rays, None]) * t
+                  + 2 * c2[rays, None]) * t + c1[rays, None]
+            t = t - numpy.divide(p, dp, out=numpy.zeros_like(p), where=dp != 0)
+        # grazing rays give a nearly double root with a tiny imaginary part
+        real = (numpy.abs(roots.imag) < 1e-4) & (t > 1e-9)
+        hits[rays] = numpy.sort(numpy.where(real, t * scale, numpy.inf),
+                                axis=1)
+    return hits
+
+
+def _pixel_rays(output_size: Tuple[int, int], rotation: numpy.ndarray,
+                sx: numpy.ndarray, sy: numpy.ndarray, subsamples: int
+                ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """ Unit ray directions in model space through the output pixels (sx, sy)
+        (1d arrays), subsamples**2 per pixel, flattened as (pixel, subsample).
+        Also the unnormalised rays in camera space. """
+    output_width, output_height = output_size
+    how, hoh = output_width / 2, output_height / 2
+
+    # subsample offsets within a pixel, whose centre is at integer (sx, sy)
+    offsets = (numpy.arange(subsamples) + 0.5) / subsamples - 0.5
+    offset_x, offset_y = [o.ravel() for o in numpy.meshgrid(offsets, offsets)]
+
+    sx = (sx[..., numpy.newaxis] + offset_x).ravel()
+    sy = (sy[..., numpy.newaxis] + offset_y).ravel()
+    camera_rays = numpy.stack(((sx - how) / how, -(sy - hoh) / hoh,
+                               numpy.ones_like(sx)), axis=1)
+    directions = camera_rays @ rotation
+    directions /= numpy.linalg.norm(directions, axis=1)[:, numpy.newaxis]
+    return directions, camera_rays
+
+
+def _band_rays(output_size: Tuple[int, int], rotation: numpy.ndarray,
+               y0: int, y1: int, subsamples: int
+               ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """ _pixel_rays for rows y0 to y1 of the output, flattened as
+        (x, y, subsample). """
+    sx, sy = numpy.meshgrid(numpy.arange(output_size[0]),
+                            numpy.arange(y0, y1), indexing='ij')
+    return _pixel_rays(output_size, rotation, sx.ravel(), sy.ravel(),
+                       subsamples)
+
+
+def _hit_geometry(origin: numpy.ndarray, directions: numpy.ndarray,
+                  t: numpy.ndarray, rw: float, camera_matrix: numpy.ndarray,
+                  how: float, subsamples: int) -> dict:
+    """ Where the rays cross the torus at distances t:
+          theta, phi    position on the torus
+          normal        (n, 3) unit normal in model space
+          depth         Z in camera space
+          footprint     plane pixels covered by the output (sub)pixel
+    """
+    x, y, z = (origin + t[:, numpy.newaxis] * directions).T
+    theta = numpy.mod(numpy.arctan2(y, x), 2 * math.pi)
+    l = numpy.hypot(x, y)
+    phi = numpy.mod(numpy.arctan2(z, l - rw), 2 * math.pi)
+    ctheta, stheta = numpy.cos(theta), numpy.sin(theta)
+    cphi, sphi = numpy.cos(phi), numpy.sin(phi)
+    normal = numpy.stack((ctheta * cphi, stheta * cphi, sphi), axis=1)
+    depth = (camera_matrix @ numpy.vstack((x, y, z, numpy.ones_like(x))))[2]
+
+    # the pixel's width at this depth, stretched by the slant of the surface,
+    # in plane pixels
+    slant = numpy.maximum(numpy.abs(numpy.einsum(
+        'ij,ij->i', normal, directions)), 1e-3)
+    footprint = depth / how / subsamples / slant * numpy.maximum(rw / l, 1)
+    return dict(theta=theta, phi=phi, normal=normal, depth=depth,
+                footprint=footprint)
+
+
+def _sample_hits(plane_sampler: sampler.PlaneSampler, origin: numpy.ndarray,
+                 directions: numpy.ndarray, t: numpy.ndarray,
+                 rw: float, rh: float, camera_matrix: numpy.ndarray,
+                 how: float, subsamples: int, filtering: str) -> dict:
+    """ As _hit_geometry, plus rgb and alpha, the (unshaded) plane there. """
+    seen = _hit_geometry(origin, directions, t, rw, camera_matrix, how,
+                         subsamples)
+    seen['rgb'], seen['alpha'] = plane_sampler.sample(
+        rw * seen['theta'], rh * seen['phi'], filtering, seen['footprint'])
+    return seen
+
+
+def _crossings(plane_sampler: sampler.PlaneSampler, origin: numpy.ndarray,
+               directions: numpy.ndarray, rw: float, rh: float,
+               camera_matrix: numpy.ndarray, how: float, subsamples: int,
+               filtering: str) -> dict:
+    """ The G-buffer (see GBuffer) of n rays, as (n, 4, ...) arrays: the
+        unshaded plane and the geometry at each place a ray crosses the
+        torus, nearest first, up to the first where the plane is opaque. """
+    hits = torus_intersections(origin, directions, rw, rh)
+    n = len(directions)
+    albedo = numpy.zeros((n, 4, 4), dtype=numpy.uint8)
+    normal = numpy.zeros((n, 4, 3), dtype=numpy.float16)
+    depth = numpy.full((n, 4), numpy.inf, dtype=numpy.float32)
+    theta = numpy.zeros((n, 4), dtype=numpy.float32)
+    phi = numpy.zeros((n, 4), dtype=numpy.float32)
+    opaque = numpy.zeros(n, dtype=bool)
+    for k in range(4):
+        rays = numpy.nonzero(numpy.isfinite(hits[:, k]) & ~opaque)[0]
+        if len(rays) == 0:
+            break
+        seen = _sample_hits(plane_sampler, origin, directions[rays],
+                            hits[rays, k], rw, rh, camera_matrix, how,
+                            subsamples, filtering)
+        albedo[rays, k, :3] = numpy.round(seen['rgb'])
+        albedo[rays, k, 3] = numpy.round(seen['alpha'])
+        normal[rays, k] = seen['normal']
+        depth[rays, k] = seen['depth']
+        theta[rays, k] = seen['theta']
+        phi[rays, k] = seen['phi']
+        opaque[rays] = albedo[rays, k, 3] == 255
+    return dict(albedo=albedo, normal=normal, depth=depth, theta=theta,
+                phi=phi)
+
+
+def _composite(albedo: numpy.ndarray, normal: numpy.ndarray,
+               parallel_light: numpy.ndarray, shadow_amount: float,
+               shading_model: str, background: numpy.ndarray
+               ) -> numpy.ndarray:
+    """ (n, 3) float colours of n rays from their G-buffer crossings, (n, k,
+        4) albedo and (n, k, 3) normal: each crossing shaded, and composited
+        front to back over the background colour. """
+    colour = numpy.zeros((len(albedo), 3))
+    # how much of what's behind still shows through
+    transmitted = numpy.ones(len(albedo))
+    for k in range(albedo.shape[1]):
+        rays = numpy.nonzero(albedo[:, k, 3] > 0)[0]
+        if len(rays) == 0:
+            continue
+        texel_rgb = shade_colours(
+            albedo[rays, k, :3].astype(numpy.float64),
+            normal[rays, k].astype(numpy.float64), parallel_light,
+            shadow_amount, shading_model)
+        weight = transmitted[rays] * albedo[rays, k, 3] / 255
+        colour[rays] += weight[:, numpy.newaxis] * texel_rgb
+        transmitted[rays] -= weight
+    return colour + transmitted[:, numpy.newaxis] * background
+
+
+# what the raycast engine draws the torus over
+WHITE = numpy.array((255, 255, 255), dtype=numpy.float64)
+
+
+def _raycast_pixels(plane_sampler: sampler.PlaneSampler,
+                    output_size: Tuple[int, int],
+                    sx: numpy.ndarray, sy: numpy.ndarray,
+                    rw: float, rh: float, camera_matrix: numpy.ndarray,
+                    parallel_light: numpy.ndarray, shadow_amount: float,
+                    shading_model: str, filtering: str,
+                    subsamples: int) -> numpy.ndarray:
+    """ The raycast torus at output pixels (sx, sy), as an (n, 3) array: the
+        G-buffer of their rays, shaded as relight does over white, and
+        averaged. """
+    how = output_size[0] / 2
+
+    # camera space is model space rotated then translated; undo that
+    camera_matrix = camera_matrix.astype(numpy.float64)
+    rotation = camera_matrix[:3, :3]
+    origin = rotation.T @ -camera_matrix[:3, 3]
+
+    directions, _ = _pixel_rays(output_size, rotation, sx, sy, subsamples)
+    seen = _crossings(plane_sampler, origin, directions, rw, rh,
+                      camera_matrix, how, subsamples, filtering)
+    colour = _composite(seen['albedo'], seen['normal'], parallel_light,
+                        shadow_amount, shading_model, WHITE)
+    colour = colour.reshape(len(sx), subsamples ** 2, 3)
+    return numpy.round(
+        numpy.clip(colour.mean(axis=1), 0, 255)).astype(numpy.uint8)
+
+
+def _raycast_band(plane_sampler: sampler.PlaneSampler,
+                  output_size: Tuple[int, int], y0: int, y1: int,
+                  rw: float, rh: float, camera_matrix: numpy.ndarray,
+                  parallel_light: numpy.ndarray, shadow_amount: float,
+                  shading_model: str, filtering: str,
+                  subsamples: int) -> numpy.ndarray:
+    """ Rows y0 to y1 of the raycast torus, as a (width, y1 - y0, 3) array. """
+    sx, sy = numpy.meshgrid(numpy.arange(output_size[0]),
+                            numpy.arange(y0, y1), indexing='ij')
+    return _raycast_pixels(
+        plane_sampler, output_size, sx.ravel(), sy.ravel(), rw, rh,
+        camera_matrix, parallel_light, shadow_amount, shading_model,
+        filtering, subsamples).reshape(output_size[0], y1 - y0, 3)
+
+
+def _raycast_tile(plane_reference, plane_size: Tuple[int, int],
+                  output_size: Tuple[int, int], rows: Tuple[int, int],
+                  parallel_light: numpy.ndarray, shadow_amount: float,
+                  shading_model: str, filtering: str, subsamples: int,
+                  band_height: int) -> numpy.ndarray:
+    """ Worker for _torus_layer_raycast: rows (y0, y1) of the output, in bands
+        of band_height rows. """
+    rw, rh, camera_matrix = torus_geometry(plane_size)
+    plane_sampler = _shared_sampler(plane_reference, plane_size)
+    return numpy.concatenate([
+        _raycast_band(plane_sampler, output_size, y0,
+                      min(y0 + band_height, rows[1]), rw, rh, camera_matrix,
+                      parallel_light, shadow_amount, shading_model, filtering,
+                      subsamples)
+        for y0 in range(rows[0], rows[1], band_height)], axis=1)
+
+
+def _torus_layer_raycast(output_size: Tuple[int, int], plane: pygame.Surface,
+                         rw: float, rh: float, camera_matrix: numpy.ndarray,
+                         parallel_light: numpy.ndarray, shadow_amount: float,
+                         shading_model: str, filtering: str,
+                         subsamples: int, band_height: int = 32,
+                         workers: int = 1) -> pygame.Surface:
+    """ Inverse-mapping implementation of project_image_to_torus: casts
+        subsamples**2 rays through each output pixel, finds where they cross
+        the torus, and samples and shades the plane there.  Crossings are
+        composited front to back over a white background.  Works in bands of
+        band_height rows, which with workers > 1 are shared out between
+        worker processes in tiles of several bands. """
+    output_width, output_height = output_size
+
+    layer = pygame.Surface(size=output_size, flags=pygame.SRCALPHA)
+    layer.fill((255, 255, 255, 255))
+    layer_rgb = pygame.surfarray.pixels3d(layer)
+
+    if workers > 1:
+        edges = numpy.linspace(0, output_height,
+                               workers * sampler.CHUNKS_PER_WORKER + 1)
+        edges = sorted({round(e) for e in edges})
+        plane_memory = sampler.share_plane(plane,
+                                           filtering == 'trilinear')
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(_raycast_tile,
+                                sampler.plane_reference(plane, plane_memory),
+                                plane.get_size(), output_size, (y0, y1),
+                                parallel_light, shadow_amount, shading_model,
+                                filtering, subsamples, band_height): (y0, y1)
+                    for y0, y1 in zip(edges[:-1], edges[1:])}
+                done = 0
+                for future in as_completed(futures):
+                    y0, y1 = futures[future]
+                    layer_rgb[:, y0:y1] = future.result()
+                    done += y1 - y0
+                    progress = done / output_height * 100
+                    print(f"\rTorus ray casting: {progress:.0f}%", end="",
+                          flush=True)
+        finally:
+            sampler.release_plane(plane_memory)
+    else:
+        plane_sampler = sampler.sampler_for(plane)
+        for y0 in range(0, output_height, band_height):
+            y1 = min(y0 + band_height, output_height)
+            progress = y1 / output_height * 100
+            print(f"\rTorus ray casting: {progress:.0f}%", end="", flush=True)
+            layer_rgb[:, y0:y1] = _raycast_band(
+                plane_sampler, output_size, y0, y1, rw, rh, camera_matrix,
+                parallel_light, shadow_amount, shading_model, filtering,
+                subsamples)
+
+    print("\r", end="", flush=True)  # Clear the progress line
+    del layer_rgb
+    return layer
+
+
+def progressive_torus(
+        output_size: Tuple[int, int],
+        plane: pygame.Surface,
+        shadow_amount: float = 0.6,
+        parallel_light: (float, float, float) = (-1, -1, 1),
+        shading_model: str = 'halflambertian',
+        filtering: str = 'nearest',
+        subsamples: int = 1,
+        stride: int = progressive.PREVIEW_STRIDE,
+        chunk: int = 65536) -> Iterator[pygame.Surface]:
+    """ The torus project_image_to_torus draws with engine='raycast', coarse
+        to fine: yields a blocky preview from every stride'th pixel first,
+        then sharper ones as the gaps are filled in (see progressive.py).
+        The last image is the finished render, and all the passes together
+        cost about as much as rendering it directly.  Pixels are ray cast
+        chunk at a time.  The plane is read as it is at each pass, and isn't
+        locked between passes; its mip pyramid is kept as for
+        project_image_to_torus.
+    """
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
+    rw, rh, camera_matrix = torus_geometry(plane.get_size())
+    parallel_light = numpy.array(parallel_light, dtype=numpy.float32)
+    parallel_light /= numpy.linalg.norm(parallel_light)
+
+    output_rgb = numpy.full((*output_size, 3), 255, dtype=numpy.uint8)
+    for pass_stride, sx, sy in progressive.pass_pixels(output_size, stride):
+        # a sampler for each pass, so the plane isn't left locked between them
+        plane_sampler = sampler.sampler_for(plane)
+        for start in range(0, len(sx), chunk):
+            x, y = sx[start:start + chunk], sy[start:start + chunk]
+            output_rgb[x, y] = _raycast_pixels(
+                plane_sampler, output_size, x, y, rw, rh, camera_matrix,
+                parallel_light, shadow_amount, shading_model, filtering,
+                subsamples)
+        del plane_sampler
+
+        layer = pygame.Surface(size=output_size, flags=pygame.SRCALPHA)
+        layer.fill((255, 255, 255, 255))
+        pygame.surfarray.pixels3d(layer)[:] = progressive.fill_in(output_rgb,
+                                                                  pass_stride)
+        yield layer
+
+
+def torus_in_time(
+        seconds: float,
+        output_size: Tuple[int, int],
+        plane: pygame.Surface,
+        shadow_amount: float = 0.6,
+        parallel_light: (float, float, float) = (-1, -1, 1),
+        shading_model: str = 'halflambertian',
+        filtering: str = 'nearest',
+        max_subsamples: int = 3) -> Tuple[pygame.Surface, dict]:
+    """ The best torus engine='raycast' can draw in about seconds.  For
+        trilinear filtering the plane's mip pyramid is built first, if it
+        hasn't been already, and that counts against seconds.  A few rays are
+        timed, and from that rate and the time left it picks the most
+        subsamples**2 rays per pixel (up to max_subsamples**2) that could
+        finish the image in time, and a first pass coarse enough to take at
+        most a quarter of it (see progressive.first_stride).  Then
+        progressive_torus runs for as many passes as will fit.  The first
+        pass always runs, so if the setup and that pass take longer than
+        seconds, so does this.  Returns the image and a dict of
+          stride      1 if the image is finished, else the spacing of the
+                      pixels that were rendered (the rest are filled in)
+          subsamples  as for project_image_to_torus
+          seconds     how long it took
+    """
+    started = time.perf_counter()
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
+    # one-off costs, which mustn't be mistaken for the rate
+    plane_sampler = sampler.sampler_for(plane)
+    if filtering == 'trilinear':
+        plane_sampler.build_pyramid()
+
+    # rays a second, from a sparse grid of pixels
+    rw, rh, camera_matrix = torus_geometry(plane.get_size())
+    light = numpy.array(parallel_light, dtype=numpy.float32)
+    light /= numpy.linalg.norm(light)
+    _, sx, sy = next(progressive.pass_pixels(output_size, 32))
+    start = time.perf_counter()
+    _raycast_pixels(plane_sampler, output_size, sx, sy, rw, rh, camera_matrix,
+                    light, shadow_amount, shading_model, filtering, 1)
+    rate = len(sx) / max(time.perf_counter() - start, 1e-6)
+    del plane_sampler
+
+    remaining = seconds - (time.perf_counter() - started)
+    num_pixels = output_size[0] * output_size[1]
+    subsamples = 1
+    while (subsamples < max_subsamples and
+           num_pixels * (subsamples + 1) ** 2 / rate <= remaining):
+        subsamples += 1
+    stride = progressive.first_stride(output_size, rate / subsamples ** 2,
+                                      remaining)
+
+    image, stride = progressive.within(
+        progressive_torus(output_size, plane, shadow_amount, parallel_light,
+                          shading_model, filtering, subsamples, stride),
+        output_size, stride, seconds, started)
+    return image, dict(stride=stride, subsamples=subsamples,
+                       seconds=time.perf_counter() - started)
+
+
+class TorusMap(object):
+    """ For each output pixel of a torus render, every place its ray crosses
+        the torus, nearest first: (theta, phi), the normal and the footprint.
+        These depend only on the output size, the plane size and the camera,
+        so any plane of that size can then be rendered with just a gather
+        and shading.  Arrays are indexed [x, y, crossing]; theta is nan for
+        the crossings a ray doesn't have.
+    """
+
+    def __init__(self, theta: numpy.ndarray, phi: numpy.ndarray,
+                 normal: numpy.ndarray, footprint: numpy.ndarray):
+        self.theta = theta  # (w, h, 4) float32
+        self.phi = phi  # (w, h, 4) float32
+        self.normal = normal  # (w, h, 4, 3) float16
+        self.footprint = footprint  # (w, h, 4) float16
+
+    @staticmethod
+    def compute(output_size: Tuple[int, int], plane_size: Tuple[int, int],
+                band_height: int = 32) -> 'TorusMap':
+        output_width, output_height = output_size
+        how = output_width / 2
+        rw, rh, camera_matrix = torus_geometry(plane_size)
+        camera_matrix = camera_matrix.astype(numpy.float64)
+        rotation = camera_matrix[:3, :3]
+        origin = rotation.T @ -camera_matrix[:3, 3]
+
+        num_pixels = output_width * output_height
+        theta = numpy.full((num_pixels, 4), numpy.nan, dtype=numpy.float32)
+        phi = numpy.zeros((num_pixels, 4), dtype=numpy.float32)
+        normal = numpy.zeros((num_pixels, 4, 3), dtype=numpy.float16)
+        footprint = numpy.zeros((num_pixels, 4), dtype=numpy.float16)
+
+        for y0 in range(0, output_height, band_height):
+            y1 = min(y0 + band_height, output_height)
+            progress = y1 / output_height * 100
+            print(f"\rTorus map: {progress:.0f}%", end="", flush=True)
+
+            directions, _ = _band_rays(output_size, rotation, y0, y1, 1)
+            hits = torus_intersections(origin, directions, rw, rh)
+            pixels = (numpy.arange(output_width)[:, numpy.newaxis] *
+                      output_height + numpy.arange(y0, y1)).ravel()
+            for k in range(4):
+                rays = numpy.nonzero(numpy.isfinite(hits[:, k]))[0]
+                if len(rays) == 0:
+                    break
+                seen = _hit_geometry(origin, directions[rays], hits[rays, k],
+                                     rw, camera_matrix, how, 1)
+                p = pixels[rays]
+                theta[p, k] = seen['theta']
+                phi[p, k] = seen['phi']
+                normal[p, k] = seen['normal']
+                footprint[p, k] = numpy.minimum(seen['footprint'],
+                                                numpy.finfo(numpy.float16).max)
+
+        print("\r", end="", flush=True)  # Clear the progress line
+        shape = (output_width, output_height, 4)
+        return TorusMap(theta.reshape(shape), phi.reshape(shape),
+                        normal.reshape(*shape, 3), footprint.reshape(shape))
+
+    def render(self, plane: pygame.Surface,
+               shadow_amount: float = 0.6,
+               parallel_light: (float, float, float) = (-1, -1, 1),
+               shading_model: str = 'halflambertian',
+               filtering: str = 'nearest') -> pygame.Surface:
+        """ The torus wrapped in the plane, as the raycast engine would draw
+            it with one ray per pixel. """
+        rw, rh, _ = torus_geometry(plane.get_size())
+        plane_sampler = sampler.sampler_for(plane)
+        parallel_light = numpy.array(parallel_light, dtype=numpy.float32)
+        parallel_light /= numpy.linalg.norm(parallel_light)
+
+        output_width, output_height = self.theta.shape[:2]
+        num_pixels = output_width * output_height
+        theta = self.theta.reshape(num_pixels, 4)
+        phi = self.phi.reshape(num_pixels, 4)
+        normal = self.normal.reshape(num_pixels, 4, 3)
+        footprint = self.footprint.reshape(num_pixels, 4)
+
+        # premultiplied colour and alpha in [0, 1] along each ray
+        colour = numpy.zeros((num_pixels, 3))
+        alpha = numpy.zeros(num_pixels)
+        for k in range(4):
+            rays = numpy.nonzero(~numpy.isnan(theta[:, k]) & (alpha < 1))[0]
+            if len(rays) == 0:
+                break
+            texel_rgb, texel_alpha = plane_sampler.sample(
+                rw * theta[rays, k].astype(numpy.float64),
+                rh * phi[rays, k].astype(numpy.float64), filtering,
+                footprint[rays, k].astype(numpy.float64))
+            texel_rgb = shade_colours(texel_rgb, normal[rays, k].astype(
+                numpy.float64), parallel_light, shadow_amount, shading_model)
+            weight = (1 - alpha[rays]) * texel_alpha / 255
+            colour[rays] += weight[:, numpy.newaxis] * texel_rgb
+            alpha[rays] += weight
+        colour += (1 - alpha)[:, numpy.newaxis] * 255
+
+        layer = pygame.Surface(size=(output_width, output_height),
+                               flags=pygame.SRCALPHA)
+        layer.fill((255, 255, 255, 255))
+        layer_rgb = pygame.surfarray.pixels3d(layer)
+        layer_rgb[:] = numpy.round(numpy.clip(colour, 0, 255)).astype(
+            numpy.uint8).reshape(output_width, output_height, 3)
+        del layer_rgb
+        return layer
+
+    # for array_cache, which keeps them
+    _ARRAYS = ('theta', 'phi', 'normal', 'footprint')
+
+
+# part of the name of every map, as SPHERE_LUT_VERSION is for sphere LUTs
+TORUS_MAP_VERSION = 1
+
+# Most recently used maps.  At 1200 x 1200 each is about 100 MB.
+TORUS_MAP_CACHE_SIZE = 2
+_map_cache = array_cache.ArrayCache(TorusMap, "torus_map", TORUS_MAP_VERSION,
+                                    TORUS_MAP_CACHE_SIZE)
+
+
+def torus_map_key(output_size: Tuple[int, int],
+                  plane_size: Tuple[int, int]) -> str:
+    """ Names the map for a torus render, in memory and on disk.  The camera
+        is part of the key, in case it changes. """
+    _, _, camera_matrix = torus_geometry(plane_size)
+    camera = hashlib.sha1(camera_matrix.tobytes()).hexdigest()[:12]
+    return _map_cache.key(f"{output_size[0]}x{output_size[1]}",
+                          f"{plane_size[0]}x{plane_size[1]}", camera)
+
+
+def torus_map(output_size: Tuple[int, int], plane_size: Tuple[int, int],
+              directory: Optional[str] = None) -> TorusMap:
+    """ The TorusMap for a render, from the in-memory cache, else from
+        directory (if given), else computed (and saved to directory). """
+    return _map_cache.get(torus_map_key(output_size, plane_size),
+                          lambda: TorusMap.compute(output_size, plane_size),
+                          directory)
+
+
+class GBuffer(object):
+    """ What each output pixel of a torus render sees, before shading: each
+        place its ray crosses the torus, nearest first, up to and including
+        the first where the plane is opaque, so a partly transparent surface
+        and what shows through it are both kept.  Arrays are indexed
+        [x, y, crossing], like surfarray.  Crossings a ray doesn't have, or
+        doesn't reach, have depth inf and alpha 0.
+    """
+
+    def __init__(self, albedo: numpy.ndarray, normal: numpy.ndarray,
+                 depth: numpy.ndarray, theta: numpy.ndarray,
+                 phi: numpy.ndarray):
+        self.albedo = albedo  # (w, h, 4, 4) uint8, the plane's RGBA
+        self.normal = normal  # (w, h, 4, 3) float16, in model space
+        self.depth = depth  # (w, h, 4) float32, Z in camera space
+        self.theta = theta  # (w, h, 4) float32
+        self.phi = phi  # (w, h, 4) float32
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.depth.shape[:2]
+
+    def save(self, path: str) -> None:
+        numpy.savez(path, albedo=self.albedo, normal=self.normal,
+                    depth=self.depth, theta=self.theta, phi=self.phi)
+
+    @staticmethod
+    def load(path: str) -> 'GBuffer':
+        with numpy.load(path) as arrays:
+            return GBuffer(**{name: arrays[name] for name in arrays.files})
+
+
+def torus_gbuffer(output_size: Tuple[int, int], plane: pygame.Surface,
+                  filtering: str = 'nearest',
+                  band_height: int = 32) -> GBuffer:
+    """ Casts a ray through each output pixel, as project_image_to_torus does
+        with engine='raycast', but instead of shading what it sees, records it
+        in a GBuffer for relight to shade, as often as you like.  The raycast
+        engine shades the same records, so relight with its lighting gives
+        the same image. """
+    if filtering not in sampler.FILTERINGS:
+        raise ValueError(f"Unknown filtering '{filtering}'")
+    output_width, output_height = output_size
+    how = output_width / 2
+    plane_sampler = sampler.sampler_for(plane)
+    rw, rh, camera_matrix = torus_geometry(plane.get_size())
+
+    camera_matrix = camera_matrix.astype(numpy.float64)
+    rotation = camera_matrix[:3, :3]
+    origin = rotation.T @ -camera_matrix[:3, 3]
+
+    num_pixels = output_width * output_height
+    gbuffer = dict(albedo=numpy.zeros((num_pixels, 4, 4), dtype=numpy.uint8),
+                   normal=numpy.zeros((num_pixels, 4, 3),
+                                      dtype=numpy.float16),
+                   depth=numpy.zeros((num_pixels, 4), dtype=numpy.float32),
+                   theta=numpy.zeros((num_pixels, 4), dtype=numpy.float32),
+                   phi=numpy.zeros((num_pixels, 4), dtype=numpy.float32))
+
+    for y0 in range(0, output_height, band_height):
+        y1 = min(y0 + band_height, output_height)
+        progress = y1 / output_height * 100
+        print(f"\rTorus G-buffer: {progress:.0f}%", end="", flush=True)
+
+        directions, _ = _band_rays(output_size, rotation, y0, y1, 1)
+        seen = _crossings(plane_sampler, origin, directions, rw, rh,
+                          camera_matrix, how, 1, filtering)
+        # flattened pixel index of each ray, as x * height + y
+        pixels = (numpy.arange(output_width)[:, numpy.newaxis] * output_height
+                  + numpy.arange(y0, y1)).ravel()
+        for name, array in gbuffer.items():
+            array[pixels] = seen[name]
+
+    print("\r", end="", flush=True)  # Clear the progress line
+    return GBuffer(**{name: array.reshape(output_width, output_height,
+                                          *array.shape[1:])
+                      for name, array in gbuffer.items()})
+
+
+def relight(gbuffer: GBuffer,
+            shadow_amount: float = 0.6,
+            parallel_light: (float, float, float) = (-1, -1, 1),
+            shading_model: str = 'halflambertian',
+            background_colour: pygame.Color = pygame.Color(255, 255, 255, 255)
+            ) -> pygame.Surface:
+    """ Shades a GBuffer, with the same lighting arguments as
+        project_image_to_torus, and composites each pixel's crossings front
+        to back over the background colour, as the raycast engine does over
+        white. """
+    parallel_light = numpy.array(parallel_light, dtype=numpy.float32)
+    parallel_light /= numpy.linalg.norm(parallel_light)
+
+    output_width, output_height = gbuffer.size
+    num_pixels = output_width * output_height
+    background = numpy.array(background_colour[:3], dtype=numpy.float64)
+    colour = _composite(gbuffer.albedo.reshape(num_pixels, -1, 4),
+                        gbuffer.normal.reshape(num_pixels, -1, 3),
+                        parallel_light, shadow_amount, shading_model,
+                        background)
+
+    layer = pygame.Surface(size=gbuffer.size, flags=pygame.SRCALPHA)
+    layer.fill(background_colour)
+    layer_rgb = pygame.surfarray.pixels3d(layer)
+    layer_rgb[:] = numpy.round(numpy.clip(colour, 0, 255)).astype(
+        numpy.uint8).reshape(output_width, output_height, 3)
+    del layer_rgb
+    return layer
+
+
 # Usage example
 if __name__ == "__main__":
     def main():
@@ -0,0 +1,351 @@
+import weakref
+import zlib
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple, Union
+
+import numpy
+import pygame
+
+
+# Filtered sampling of a plane image, shared by the sphere and torus
+# projectors.  Coordinates are in plane pixels, with pixel (i, j) centred on
+# (i, j), and wrap around at the edges.
+#
+#   'nearest'   the pixel containing (u, v)
+#   'bilinear'  a blend of the four pixels around (u, v)
+#   'trilinear' a blend of bilinear samples from the two levels of a mip
+#               pyramid that best match the footprint, the number of plane
+#               pixels covered by one output pixel.
+#
+# Blends are done with premultiplied alpha, so the colour of transparent
+# pixels doesn't leak into their neighbours.
+
+FILTERINGS = ('nearest', 'bilinear', 'trilinear')
+
+
+def surface_rgb_alpha(surface: pygame.Surface
+                      ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """ (width, height, 3) colour and (width, height) alpha arrays for a
+        surface.  These are views where pygame allows it, otherwise copies.
+        Surfaces without per-pixel alpha are opaque. """
+    try:
+        rgb = pygame.surfarray.pixels3d(surface)
+    except ValueError:
+        rgb = pygame.surfarray.array3d(surface)
+    try:
+        alpha = pygame.surfarray.pixels_alpha(surface)
+    except ValueError:
+        alpha = pygame.surfarray.array_alpha(surface)
+    return rgb, alpha
+
+
+def _downsample(rgb: numpy.ndarray, alpha: numpy.ndarray,
+                chunk: int = 512) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """ Halve a level (rounding up, wrapping odd edges) with a 2x2 box filter,
+        weighting colours by alpha.  Works in strips of columns so the float
+        temporaries stay small. """
+    width, height = alpha.shape
+    new_width, new_height = (width + 1) // 2, (height + 1) // 2
+    new_rgb = numpy.empty((new_width, new_height, 3), dtype=numpy.uint8)
+    new_alpha = numpy.empty((new_width, new_height), dtype=numpy.uint8)
+
+    rows = numpy.arange(2 * new_height) % height
+    for x0 in range(0, new_width, chunk):
+        x1 = min(x0 + chunk, new_width)
+        columns = numpy.arange(2 * x0, 2 * x1) % width
+        a = alpha[columns][:, rows].astype(numpy.float32)
+        p = rgb[columns][:, rows].astype(numpy.float32) * a[..., numpy.newaxis]
+        a = a.reshape(x1 - x0, 2, new_height, 2).sum(axis=(1, 3))
+        p = p.reshape(x1 - x0, 2, new_height, 2, 3).sum(axis=(1, 3))
+        c = numpy.divide(p, a[..., numpy.newaxis], out=numpy.zeros_like(p),
+                         where=a[..., numpy.newaxis] > 0)
+        new_rgb[x0:x1] = numpy.round(c)
+        new_alpha[x0:x1] = numpy.round(a / 4)
+    return new_rgb, new_alpha
+
+
+def level_sizes(plane_size: Tuple[int, int], num_levels: int
+                ) -> List[Tuple[int, int]]:
+    """ The sizes of the first num_levels levels of a plane's mip pyramid,
+        each half the last, rounding up, as _downsample makes them. """
+    sizes = [tuple(plane_size)]
+    while len(sizes) < num_levels:
+        width, height = sizes[-1]
+        sizes.append(((width + 1) // 2, (height + 1) // 2))
+    return sizes
+
+
+def is_procedural(plane) -> bool:
+    """ Planes that aren't Surfaces (like hextiles.ProceduralHexPlane) are
+        made on demand.  They have get_size and get_at, sample and
+        build_pyramid as a PlaneSampler does, and are their own sampler. """
+    return not isinstance(plane, pygame.Surface)
+
+
+# Work shared out between worker processes (sphere bands, torus tiles,
+# hextiles strips) is cut into this many pieces per worker, so that the
+# cheap pieces and the dear ones even out.
+CHUNKS_PER_WORKER = 4
+
+
+def share_plane(plane: pygame.Surface, pyramid: bool = False
+                ) -> Optional[shared_memory.SharedMemory]:
+    """ A copy of the plane's pixels, as a (width, height, 4) RGBA array, in
+        new shared memory for worker processes to read (see shared_rgb_alpha),
+        followed by any smaller levels given by use_pyramid, or with
+        pyramid=True by its whole mip pyramid (built here, and kept, if it
+        hasn't been), so that workers doing trilinear filtering don't each
+        build it.  The caller must release it (see release_plane).  There's
+        nothing to copy for a procedural plane, so that gives None. """
+    if is_procedural(plane):
+        return None
+    if pyramid:
+        sampler_for(plane).build_pyramid()
+    _, kept, drawn_levels = _kept_levels(plane)
+    sizes = level_sizes(plane.get_size(),
+                        len(kept) + 1 if pyramid else drawn_levels)
+    plane_memory = shared_memory.SharedMemory(
+        create=True, size=max(sum(w * h * 4 for w, h in sizes), 1))
+    offset = 0
+    for level, size in enumerate(sizes):
+        if level == 0:
+            rgb, alpha = surface_rgb_alpha(plane)
+        else:
+            rgb, alpha = kept[level - 1]
+        shared_rgb, shared_alpha = shared_rgb_alpha(plane_memory, size, offset)
+        shared_rgb[:] = rgb
+        shared_alpha[:] = alpha
+        del rgb, alpha, shared_rgb, shared_alpha
+        offset += size[0] * size[1] * 4
+    _shared_levels[plane_memory.name] = len(sizes)
+    return plane_memory
+
+
+# the number of levels in each plane's shared memory, by its name
+_shared_levels: dict = {}
+
+
+def shared_rgb_alpha(plane_memory: shared_memory.SharedMemory,
+                     plane_size: Tuple[int, int], offset: int = 0
+                     ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """ Colour and alpha views of a plane (or, offset bytes in, a level of
+        one) shared by share_plane.  They must be deleted before plane_memory
+        is closed. """
+    plane_rgba = numpy.ndarray((*plane_size, 4), dtype=numpy.uint8,
+                               buffer=plane_memory.buf, offset=offset)
+    return plane_rgba[..., :3], plane_rgba[..., 3]
+
+
+def plane_reference(plane, plane_memory: Optional[shared_memory.SharedMemory]
+                    ) -> Union[Tuple[str, int], object]:
+    """ What to send worker processes for a plane: the name of the shared
+        memory it was copied to and the number of levels there, or a
+        procedural plane itself (it's pickled, but it's just the tiles and the
+        seed). """
+    if plane_memory is None:
+        return plane
+    return plane_memory.name, _shared_levels[plane_memory.name]
+
+
+def open_plane(reference, plane_size: Tuple[int, int]
+               ) -> Tuple[Optional[shared_memory.SharedMemory], object]:
+    """ In a worker, (shared memory, sampler) for a plane_reference.  The
+        memory is None for a procedural plane.  The sampler must be deleted
+        before the memory is closed. """
+    if not isinstance(reference, tuple):
+        return None, reference
+    name, num_levels = reference
+    plane_memory = shared_memory.SharedMemory(name=name)
+    levels = []
+    offset = 0
+    for size in level_sizes(plane_size, num_levels):
+        levels.append(shared_rgb_alpha(plane_memory, size, offset))
+        offset += size[0] * size[1] * 4
+    plane_sampler = PlaneSampler(*levels[0])
+    plane_sampler.levels = levels
+    plane_sampler.drawn_levels = num_levels
+    return plane_memory, plane_sampler
+
+
+def release_plane(plane_memory: Optional[shared_memory.SharedMemory]) -> None:
+    """ Closes and unlinks memory from share_plane. """
+    if plane_memory is not None:
+        _shared_levels.pop(plane_memory.name, None)
+        plane_memory.close()
+        plane_memory.unlink()
+
+
+class PlaneSampler(object):
+    """ Samples a plane at arrays of (u, v) coordinates.  The mip pyramid is
+        built the first time trilinear filtering is asked for, and kept. """
+
+    def __init__(self, rgb: numpy.ndarray, alpha: numpy.ndarray,
+                 plane: Optional[pygame.Surface] = None):
+        self.size = alpha.shape
+        # levels[i] is (rgb, alpha) at 1 / 2**i of the plane's size
+        self.levels = [(rgb, alpha)]
+        # how many of them were given, rather than built from the one above
+        self.drawn_levels = 1
+        self.pyramid_built = False
+        # the Surface that rgb and alpha are the pixels of, if its pyramid
+        # is to be kept for later samplers (see sampler_for)
+        self.plane = plane
+
+    @property
+    def opaque(self) -> bool:
+        return self.levels[0][1].min() == 255
+
+    def build_pyramid(self) -> None:
+        if self.pyramid_built:
+            return
+        if self.plane is not None:
+            checksum, kept, self.drawn_levels = _kept_levels(self.plane)
+            self.levels[1:] = kept
+        rgb, alpha = self.levels[-1]
+        while max(alpha.shape) > 1:
+            rgb, alpha = _downsample(rgb, alpha)
+            self.levels.append((rgb, alpha))
+        self.pyramid_built = True
+        if self.plane is not None:
+            _pyramids[self.plane] = (checksum, self.levels[1:],
+                                     self.drawn_levels)
+
+    def _bilinear(self, level: int, u: numpy.ndarray, v: numpy.ndarray
+                  ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ Premultiplied (n, 3) colour and (n,) alpha in [0, 1] at one
+            level. """
+        rgb, alpha = self.levels[level]
+        width, height = alpha.shape
+        ul = (u + 0.5) * (width / self.size[0]) - 0.5
+        vl = (v + 0.5) * (height / self.size[1]) - 0.5
+        x0 = numpy.floor(ul)
+        y0 = numpy.floor(vl)
+        fx = (ul - x0)[:, numpy.newaxis]
+        fy = (vl - y0)[:, numpy.newaxis]
+        x0 = numpy.mod(x0, width).astype(numpy.intp)
+        y0 = numpy.mod(y0, height).astype(numpy.intp)
+        x1 = (x0 + 1) % width
+        y1 = (y0 + 1) % height
+
+        premultiplied = numpy.zeros((len(u), 3), dtype=numpy.float64)
+        total_alpha = numpy.zeros((len(u), 1), dtype=numpy.float64)
+        for xs, ys, weight in ((x0, y0, (1 - fx) * (1 - fy)),
+                               (x1, y0, fx * (1 - fy)),
+                               (x0, y1, (1 - fx) * fy),
+                               (x1, y1, fx * fy)):
+            a = alpha[xs, ys][:, numpy.newaxis] * (weight / 255)
+            premultiplied += rgb[xs, ys] * a
+            total_alpha += a
+        return premultiplied, total_alpha[:, 0]
+
+    def sample(self, u: numpy.ndarray, v: numpy.ndarray,
+               filtering: str = 'bilinear',
+               footprint: Optional[numpy.ndarray] = None
+               ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """ (n, 3) colours and (n,) alphas, as floats in [0, 255], of the
+            plane at the 1d arrays u and v.  footprint (plane pixels per output
+            pixel, per sample) is needed for trilinear filtering. """
+        u = numpy.asarray(u, dtype=numpy.float64)
+        v = numpy.asarray(v, dtype=numpy.float64)
+        if filtering == 'nearest':
+            rgb, alpha = self.levels[0]
+            uu = numpy.mod(numpy.floor(u + 0.5), self.size[0]).astype(numpy.intp)
+            vv = numpy.mod(numpy.floor(v + 0.5), self.size[1]).astype(numpy.intp)
+            return (rgb[uu, vv].astype(numpy.float64),
+                    alpha[uu, vv].astype(numpy.float64))
+
+        if filtering == 'bilinear':
+            premultiplied, alpha = self._bilinear(0, u, v)
+        elif filtering == 'trilinear':
+            if footprint is None:
+                raise ValueError("trilinear filtering needs a footprint")
+            self.build_pyramid()
+            level = numpy.clip(numpy.log2(numpy.maximum(footprint, 1)),
+                               0, len(self.levels) - 1)
+            lower = numpy.floor(level).astype(numpy.intp)
+            t = (level - lower)[:, numpy.newaxis]
+            premultiplied = numpy.zeros((len(u), 3), dtype=numpy.float64)
+            alpha = numpy.zeros((len(u), 1), dtype=numpy.float64)
+            for i in numpy.unique(lower):
+                at = lower == i
+                p0, a0 = self._bilinear(i, u[at], v[at])
+                j = min(i + 1, len(self.levels) - 1)
+                p1, a1 = self._bilinear(j, u[at], v[at])
+                premultiplied[at] = p0 + (p1 - p0) * t[at]
+                alpha[at] = a0[:, numpy.newaxis] + (
+                        a1 - a0)[:, numpy.newaxis] * t[at]
+            alpha = alpha[:, 0]
+        else:
+            raise ValueError(f"Unknown filtering '{filtering}'")
+
+        colour = numpy.divide(premultiplied, alpha[:, numpy.newaxis],
+                              out=numpy.zeros_like(premultiplied),
+                              where=alpha[:, numpy.newaxis] > 0)
+        return numpy.clip(colour, 0, 255), alpha * 255
+
+
+# The levels of each plane's mip pyramid above the plane itself, built for
+# trilinear filtering or given by use_pyramid, kept as long as the plane is.
+# Each is (checksum of the plane's pixels they were made from, levels, how
+# many levels were given), so that they're made again if the plane has been
+# drawn on since.
+_pyramids: 'weakref.WeakKeyDictionary[pygame.Surface, Tuple[int, list, int]]' \
+    = weakref.WeakKeyDictionary()
+
+
+def _checksum(plane: pygame.Surface) -> int:
+    """ A CRC of the plane's pixels, which any drawing on it changes.  It
+        reads the plane once, a small part of the cost of shrinking it. """
+    return zlib.crc32(plane.get_buffer())
+
+
+def _kept_levels(plane: pygame.Surface) -> Tuple[int, list, int]:
+    """ (checksum, levels, how many of the plane's levels were given) for
+        the pyramid kept for a plane, as in _pyramids.  If there isn't one,
+        or the plane has been drawn on since it was made, there are no levels
+        and just the plane itself was given. """
+    checksum = _checksum(plane)
+    kept = _pyramids.get(plane)
+    if kept is None or kept[0] != checksum:
+        _pyramids.pop(plane, None)
+        return checksum, [], 1
+    return kept
+
+
+def sampler_for(plane: pygame.Surface) -> PlaneSampler:
+    """ A PlaneSampler for a plane, reading its pixels as they are now.  It
+        holds a view of them, so the plane stays locked until the sampler is
+        deleted.  The pyramid trilinear filtering builds is kept for the next
+        sampler of the plane, unless the plane is drawn on in between.  A
+        procedural plane is its own sampler. """
+    if is_procedural(plane):
+        return plane
+    return PlaneSampler(*surface_rgb_alpha(plane), plane=plane)
+
+
+def forget_sampler(plane: pygame.Surface) -> None:
+    """ Drops the pyramid kept for a plane, to free its memory. """
+    _pyramids.pop(plane, None)
+
+
+def use_pyramid(plane: pygame.Surface, levels: List[pygame.Surface]) -> None:
+    """ Makes levels (each half the size of the last, rounding up, starting
+        from half the plane's size) the top of the plane's mip pyramid, in
+        place of shrinking the plane, for planes that can be drawn at any
+        scale (see hextiles.create_random_hexagonal_tiled_surface).  Trilinear
+        filtering picks the levels that match the footprint, and shrinks the
+        last for any levels below it.  Workers are sent the levels with the
+        plane.  forget_sampler forgets them, as does drawing on the plane.
+        This copies the levels (a third of the plane's size, between them)
+        and reads the plane once for its checksum, but doesn't copy the plane
+        (see benchmarks.py hextiles_pyramid). """
+    sizes = level_sizes(plane.get_size(), len(levels) + 1)
+    for level, size in zip(levels, sizes[1:]):
+        if level.get_size() != size:
+            raise ValueError(f"A level of size {level.get_size()} where "
+                             f"{size} was expected")
+    _pyramids[plane] = (_checksum(plane),
+                        [(pygame.surfarray.array3d(level),
+                          pygame.surfarray.array_alpha(level))
+                         for level in levels],
+                        len(levels) + 1)
@@ -1,4 +1,4 @@
-from typing import Optional, Tuple
+from typing import Iterable, Optional, Tuple
 
 import pygame
 
@@ -30,3 +30,28 @@ def show_canvas(canvas: pygame.Surface,
                 running = False
 
     pygame.quit()
+
+
+# Show each image from a progressive render (see progressive.py) as it
+# arrives, then wait for ESC as show_canvas does.  Returns the last image.
+def show_progress(images: Iterable[pygame.Surface],
+                  size: Optional[Tuple[int, int]] = None,
+                  title: Optional[str] = None) -> pygame.Surface:
+    screen = None
+    image = None
+    for image in images:
+        if screen is None:
+            screen = pygame.display.set_mode(
+                image.get_size() if size is None else size)
+            if title is not None:
+                pygame.display.set_caption(title=title)
+        shown = image
+        if image.get_size() != screen.get_size():
+            shown = pygame.transform.smoothscale(image, screen.get_size())
+        screen.blit(shown, (0, 0))
+        pygame.display.flip()
+        pygame.event.pump()  # keep the window responsive between passes
+
+    if image is not None:
+        show_canvas(image, size, title)
+    return image